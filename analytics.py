@@ -0,0 +1,93 @@
+"""
+קוביית סיכומים לניתוח עלויות מעל החיובים המותאמים: לכל ממד (חשבונית, סוג חיוב, רישום, מסלול,
+חודש, טיול בלאון) טבלה מקובצת לפי חודש + הממד עם מדדים חיבוריים (סנטים ומספרי טיסות).
+המדדים חיבוריים, ולכן קוביות של קבצים שונים מתמזגות בחיבור בלי לחזור לשורות עצמן.
+"""
+import numpy as np
+import pandas as pd
+
+# ממד -> עמודות הקיבוץ בטבלת התוצאות
+DIMENSIONS = {
+    'Invoice': ['Invoice No'],
+    'Charge Type': ['Charge Type'],
+    'Registration': ['Reg'],
+    'Route': ['Dep', 'Arr'],
+    'Month': ['Month'],
+    'Leon Trip': ['Leon Trip Number'],
+}
+MEASURES = ['Flights', 'Amount_Cents', 'Matched Flights', 'Unmatched Flights', 'Unmatched_Cents']
+
+def _months(dates):
+    """חודש הטיסה כ-category של מחרוזות (2024-03), בלי המרה לכל שורה בנפרד"""
+    codes, periods = pd.factorize(dates.dt.to_period('M'))
+    return pd.Categorical.from_codes(codes, categories=periods.astype(str))
+
+def build_cube(df):
+    """
+    בונה את הקובייה מטבלת חיובים מותאמת (Amount_Cents, ואם אין - Amount ביורו).
+    מחזיר מילון ממד -> DataFrame עם אינדקס (Month, עמודות הממד) ועמודות MEASURES.
+    """
+    cents = df['Amount_Cents'] if 'Amount_Cents' in df.columns else np.rint(df['Amount'] * 100)
+    cents = cents.to_numpy(dtype=np.int64)
+    unmatched = (df['Matched?'] != 'YES').to_numpy()
+    facts = pd.DataFrame({
+        'Month': _months(df['Date']),
+        **{column: df[column].to_numpy() for columns in DIMENSIONS.values() for column in columns
+           if column != 'Month'},
+        'Flights': 1,
+        'Amount_Cents': cents,
+        'Matched Flights': (~unmatched).astype(np.int64),
+        'Unmatched Flights': unmatched.astype(np.int64),
+        'Unmatched_Cents': np.where(unmatched, cents, 0),
+    })
+    cube = {}
+    for dimension, columns in DIMENSIONS.items():
+        keys = ['Month'] + [column for column in columns if column != 'Month']
+        cube[dimension] = facts.groupby(keys, observed=True, dropna=False, sort=False)[MEASURES].sum()
+    return cube
+
+def merge_cubes(cubes):
+    """מחבר קוביות (למשל של קבצים שונים) - הסכום זהה לקובייה שנבנית מכל השורות יחד"""
+    cubes = [cube for cube in cubes if cube]
+    if len(cubes) <= 1:
+        return cubes[0] if cubes else {}
+    merged = {}
+    for dimension in DIMENSIONS:
+        tables = pd.concat([cube[dimension] for cube in cubes])
+        levels = list(range(tables.index.nlevels))
+        merged[dimension] = tables.groupby(level=levels, dropna=False, sort=False).sum()
+    return merged
+
+def cube_months(cube):
+    """החודשים שבקובייה, ממוינים"""
+    return sorted(cube['Month'].index.dropna()) if cube else []
+
+def cube_view(cube, dimension, months=None):
+    """
+    טבלת הסיכום של ממד (רק לחודשים ב-months, אם נמסרו) בסכומים ביורו, ממוינת לפי הסכום.
+    עובדת על הקובייה בלבד - בלי לעבור שוב על שורות החיובים.
+    """
+    table = cube[dimension]
+    if months:
+        table = table[table.index.get_level_values('Month').isin(months)]
+    if dimension != 'Month':
+        table = table.groupby(level=DIMENSIONS[dimension], dropna=False, sort=False).sum()
+    flights = table['Flights']
+    view = pd.DataFrame({
+        'Flights': flights,
+        'Amount': table['Amount_Cents'] / 100,
+        'Matched Flights': table['Matched Flights'],
+        'Match Rate': (table['Matched Flights'] / flights.where(flights > 0) * 100).round(1),
+        'Unmatched Flights': table['Unmatched Flights'],
+        'Unmatched Amount': table['Unmatched_Cents'] / 100,
+    })
+    if dimension == 'Month':
+        return view.sort_index(key=lambda months: months.astype(str)).reset_index()
+    return view.sort_values('Amount', ascending=False, kind='stable').reset_index()
+
+def exposure(cube, months=None):
+    """סך החיובים וסך החיובים שלא הותאמו (ביורו) בחודשים הנבחרים"""
+    table = cube['Month']
+    if months:
+        table = table[table.index.isin(months)]
+    return int(table['Amount_Cents'].sum()) / 100, int(table['Unmatched_Cents'].sum()) / 100
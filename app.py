@@ -1,8 +1,26 @@
 import streamlit as st
 import pandas as pd
-import re
-from decimal import Decimal
-import io
+import numpy as np
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from analytics import DIMENSIONS, build_cube, cube_months, cube_view, exposure, merge_cubes
+from auditor import EXCEL_MAX_ROWS, ChunkPrefetcher, filter_results, generate_csv_gz, generate_excel, iter_euro_source, run_audit
+from eurocontrol import detect_charge_type
+from ledger import Ledger
+from matching import LeonIndex, load_leon_report
+from parse_cache import ParseCache
+from profiling import StageProfile
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# מספר תהליכי הפענוח כברירת מחדל (ניתן לקבוע דרך AUDITOR_WORKERS)
+DEFAULT_WORKERS = int(os.environ.get('AUDITOR_WORKERS', os.cpu_count() or 1))
 
 # --- הגדרות עמוד ותצוגה ---
 st.set_page_config(page_title="Aviation Invoice Auditor", layout="wide", page_icon="✈️")
@@ -17,101 +35,128 @@ st.markdown("""
 
 # --- פונקציות לוגיקה ועיבוד ---
 
-def extract_invoice_reference(content):
+@st.cache_resource
+def get_parse_cache():
+    """מטמון הפענוח בדיסק - מופע אחד משותף לכל הסשנים"""
+    return ParseCache()
+
+@st.cache_resource
+def get_ledger():
+    """יומן ההתאמות (SQLite) - חיבור אחד משותף לכל הסשנים"""
+    return Ledger()
+
+# תקרת הזיכרון לתוצאות ביקורת שמורות (לכל המשתמשים יחד)
+AUDIT_STORE_MB = int(os.environ.get('AUDITOR_RESULTS_MB', 1024))
+
+class AuditStore:
     """
-    מחלץ את מספר החשבונית. תומך גם בקידומת מספרית (31/...) וגם באותיות (GM/..., HE/...)
+    מטמון LRU של תוצאות ביקורת לפי מפתח הקבצים, משותף לכל הסשנים ומוגבל בגודל.
+    הסשן שומר רק את המפתח, כך שהזיכרון נשלט כולו כאן.
     """
-    lines = content.splitlines()[:3]
-    for line in lines:
-        match = re.search(r'([A-Z0-9]{2}/\d{5,12}/\d{2})', line)
-        if match:
-            return match.group(1)
-    return "UNKNOWN_REF"
-
-def parse_eurocontrol_line(line_str):
-    try:
-        if len(line_str) < 10: return None
-        if isinstance(line_str, bytes):
-            line = line_str.decode('utf-8', errors='ignore')
-        else:
-            line = line_str
-            
-        if line[7:9] != '01': return None
-
-        # 1. חילוץ נתונים בסיסיים
-        flight_date = line[9:19].replace('/', '-')
-        
-        # הזהות המופיעה בקובץ (יכול להיות רישום ויכול להיות Callsign)
-        raw_identity = line[25:35].split()[0].strip()
-
-        # זיהוי מסלול
-        route_match = re.search(r'([A-Z]{4}[A-Z]{4})', line[35:55])
-        if route_match:
-            route_block = route_match.group(1)
-            dep_icao = route_block[0:4]
-            arr_icao = route_block[4:8]
-        else:
-            dep_icao = line[38:42].strip()
-            arr_icao = line[42:46].strip()
-
-        # --- התיקון לרישום המטוס ---
-        reg = None
-        # נסיון א': חיפוש רישום תקני (4X או N)
-        reg_match = re.search(r'(4X-?[A-Z]{3}|N[0-9]{1,5}[A-Z]{0,2})', line)
-        
-        if reg_match:
-            reg = reg_match.group(1).replace('-', '')
-        else:
-            # נסיון ב' (התיקון): אם אין רישום תקני, קח את מה שמופיע בעמודת הזהות (למשל HEZ333)
-            if raw_identity:
-                reg = raw_identity
-            else:
-                reg = 'UNKNOWN'
-
-        # זיהוי סכום
-        amount = Decimal("0.00")
-        amount_zone = line[35:]
-        decimal_matches = re.findall(r'(\d+,\d+)', amount_zone)
-        candidates = []
-        for m in decimal_matches:
-            val = Decimal(m.replace(',', '.'))
-            if val > 0: candidates.append(val)
-        
-        if not candidates:
-            int_matches = re.findall(r'\s(\d+)\s', amount_zone)
-            for m in int_matches:
-                val = Decimal(m)
-                if val > 0: candidates.append(val)
-        if candidates:
-            amount = candidates[0]
-
-        return {
-            'Date': flight_date,
-            'Callsign': raw_identity, # נשמור את המקור גם כאן
-            'Reg': reg,
-            'Dep': dep_icao,
-            'Arr': arr_icao,
-            'Amount': float(amount),
-            'Raw_Line': line.strip()
-        }
-    except Exception:
-        return None
-
-def generate_excel(df_main, df_unmatched):
-    """מייצר קובץ אקסל אחד עם שני גיליונות"""
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df_main.to_excel(writer, sheet_name='Main Report', index=False)
-        
-        worksheet = writer.sheets['Main Report']
-        for column_cells in worksheet.columns:
-            length = max(len(str(cell.value)) for cell in column_cells)
-            worksheet.column_dimensions[column_cells[0].column_letter].width = length + 2
-
-        if not df_unmatched.empty:
-            df_unmatched.to_excel(writer, sheet_name='Unmatched Investigation', index=False)
-            
-    return output.getvalue()
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(audit):
+        size = sum(len(data) for _, data, _, _ in audit['downloads'])
+        for value in audit.values():
+            frames = value.values() if isinstance(value, dict) else [value]
+            for frame in frames:
+                if isinstance(frame, pd.DataFrame):
+                    size += int(frame.memory_usage(deep=True).sum())
+        return size
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, audit):
+        with self._lock:
+            self._entries[key] = (audit, self._size(audit))
+            self._entries.move_to_end(key)
+            total = sum(size for _, size in self._entries.values())
+            while total > self.max_bytes and len(self._entries) > 1:
+                _, (_, size) = self._entries.popitem(last=False)
+                total -= size
+
+@st.cache_resource
+def get_audit_store():
+    return AuditStore(AUDIT_STORE_MB * 1024 * 1024)
+
+# תקרת הזיכרון לקוביות הסיכום של קבצי החשבונית (לכל המשתמשים יחד)
+FILE_CUBES_MB = int(os.environ.get('AUDITOR_CUBES_MB', 256))
+
+class CubeStore(AuditStore):
+    """אותו מטמון LRU (עם נעילה ותקרת זיכרון), לקוביות סיכום - מילון ממד -> DataFrame"""
+
+    @staticmethod
+    def _size(cube):
+        return sum(int(table.memory_usage(deep=True).sum()) for table in cube.values())
+
+@st.cache_resource
+def get_file_cubes():
+    """
+    קוביית הסיכומים של כל קובץ חשבונית, לפי (hash הקובץ, hash לאון, אפשרויות ההתאמה).
+    ביקורת עם קובץ נוסף מסכמת רק את השורות של הקובץ החדש וממזגת עם הקוביות השמורות.
+    """
+    return CubeStore(FILE_CUBES_MB * 1024 * 1024)
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def get_leon_index(file_hash, name, _data):
+    """
+    דוח לאון מנורמל יחד עם אינדקס ההתאמה, שמור בין הרצות ובין סשנים לפי hash של הקובץ.
+    התוצאה משותפת לכל המשתמשים - אסור לשנות אותה במקום.
+    """
+    leon_df = load_leon_report(_data, name)
+    return leon_df, LeonIndex(leon_df, source_hash=file_hash)
+
+# צבע שורה לפי סטטוס ההתאמה
+ROW_COLORS = {'YES': 'background-color: #d4edda', 'REVIEW': 'background-color: #fff3cd', 'NO': 'background-color: #f8d7da'}
+
+def style_rows(page):
+    """צביעת כל שורות העמוד בקריאה אחת (וקטורית) במקום פונקציה לכל שורה"""
+    colors = page['Matched?'].map(ROW_COLORS).fillna('').to_numpy()
+    styles = pd.DataFrame(np.repeat(colors[:, None], page.shape[1], axis=1), index=page.index, columns=page.columns)
+    return page.style.apply(lambda _: styles, axis=None)
+
+@st.fragment
+def results_grid(df_display):
+    """
+    טבלת התוצאות בעמודים: הסינון והמיון רצים בשרת, ורק העמוד המוצג נצבע ונשלח לדפדפן.
+    כ-fragment, שינוי בפקדים מריץ מחדש רק את הטבלה ולא את הביקורת.
+    """
+    f1, f2, f3, f4 = st.columns(4)
+    status = f1.selectbox("Status", ['All', 'Matched', 'Unmatched'])
+    invoices = f2.multiselect("Invoice", sorted(df_display['Invoice No'].astype(str).unique()))
+    reg = f3.text_input("Reg contains")
+    date_range = f4.date_input("Date range", value=())
+
+    s1, s2, s3 = st.columns(3)
+    sort_by = s1.selectbox("Sort by", ['(none)'] + list(df_display.columns))
+    descending = s2.checkbox("Descending")
+    page_size = s3.selectbox("Rows per page", [50, 100, 500, 1000], index=1)
+
+    view = filter_results(
+        df_display, status=status, invoices=invoices, reg=reg,
+        date_range=date_range if len(date_range) == 2 else None,
+        sort_by=None if sort_by == '(none)' else sort_by, descending=descending,
+    )
+    pages = max(1, math.ceil(len(view) / page_size))
+    page_number = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1)
+    start = (page_number - 1) * page_size
+    page = view.iloc[start:start + page_size]
+
+    start_render = time.perf_counter()
+    st.dataframe(style_rows(page), use_container_width=True, hide_index=True)
+    st.session_state['grid_render'] = {'seconds': round(time.perf_counter() - start_render, 4), 'rows': len(page)}
+    st.caption(f"Rows {min(start + 1, len(view))}-{start + len(page)} of {len(view)} "
+               f"(filtered from {len(df_display)})")
 
 # --- ממשק משתמש (UI) ---
 
@@ -125,134 +170,303 @@ with col1:
 with col2:
     uploaded_leon = st.file_uploader("2. Leon Report (Excel/CSV)", type=['csv', 'xlsx', 'xls'])
 
+with st.sidebar:
+    parse_workers = st.number_input("Parser processes", min_value=1, value=DEFAULT_WORKERS, step=1,
+                                    help="1 = streaming parse in this process; more = parse files in parallel.")
+    fuzzy_matching = st.checkbox("Fuzzy matching (±1 day, diverted arrivals)", value=True)
+    use_parse_cache = st.checkbox("Reuse parsed files from cache", value=True)
+    use_ledger = st.checkbox("Reconciliation ledger (skip lines matched in earlier cycles)", value=False)
+    profile_memory = st.checkbox("Profile peak memory per stage (slower)", value=False)
+    if st.button("Clear parse cache"):
+        get_parse_cache().clear()
+
+def file_hash(uploaded_file):
+    """SHA-256 של קובץ שהועלה - מחושב פעם אחת לכל העלאה ונשמר ב-session_state"""
+    hashes = st.session_state.setdefault('file_hashes', {})
+    if uploaded_file.file_id not in hashes:
+        hashes[uploaded_file.file_id] = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    return hashes[uploaded_file.file_id]
+
+def upload_names(uploaded_files):
+    """
+    שם ייחודי לכל קובץ שהועלה (המפתח של התוכן בשחזור השורות ובקוביות): לקבצים שונים עם אותו שם,
+    למשל מתיקיות שונות, נוסף מספר בסוף - הקידומת (סוג החיוב) לא משתנה.
+    """
+    seen = {}
+    names = []
+    for uploaded_file in uploaded_files:
+        seen[uploaded_file.name] = seen.get(uploaded_file.name, 0) + 1
+        count = seen[uploaded_file.name]
+        names.append(uploaded_file.name if count == 1 else f"{uploaded_file.name} ({count})")
+    return names
+
+class ParseProgress:
+    """
+    התקדמות הפענוח לכל קובץ חשבונית. on_chunk נקרא מה-thread של הפענוח ורק מעדכן מונים,
+    והציור (show) נעשה מה-thread של הדף.
+    """
+
+    def __init__(self, files):
+        self.sizes = {name: len(data) for name, data in files}
+        self.parsed = dict.fromkeys(self.sizes, 0)
+        self.rows = dict.fromkeys(self.sizes, 0)
+        self._bar = st.progress(0.0, text="Parsing invoices...")
+        self._table = st.empty()
+
+    def on_chunk(self, chunk):
+        if len(chunk):
+            name = chunk['Source File'].iat[0]
+            self.rows[name] += len(chunk)
+            self.parsed[name] = max(self.parsed[name], int(chunk['Line_End'].iat[-1]))
+
+    def show(self, finished, leon_status):
+        names = list(self.sizes)
+        # קובץ גמור כשהפענוח הסתיים או כשקובץ מאוחר יותר כבר התחיל
+        started = [i for i, name in enumerate(names) if self.parsed[name]]
+        last_started = started[-1] if started else -1
+        status, fractions = [], []
+        for i, name in enumerate(names):
+            if finished or i < last_started:
+                status.append("done")
+                fractions.append(1.0)
+            elif self.parsed[name]:
+                status.append("parsing")
+                fractions.append(min(self.parsed[name] / max(self.sizes[name], 1), 1.0))
+            else:
+                status.append("waiting")
+                fractions.append(0.0)
+        done = status.count("done")
+        self._bar.progress(sum(fractions) / max(len(names), 1),
+                           text=f"Parsing invoices: {done}/{len(names)} files done · Leon report {leon_status}")
+        self._table.dataframe(pd.DataFrame({
+            'File': names, 'Flights parsed': [self.rows[name] for name in names], 'Status': status,
+        }), hide_index=True)
+
+    def clear(self):
+        self._bar.empty()
+        self._table.empty()
+
+def compute_audit(leon_hash):
+    """
+    מריץ את הביקורת המלאה ומחזיר את כל מה שנדרש לתצוגה ולהורדה.
+    דוח לאון נטען ב-thread נפרד בזמן שהחשבוניות מפוענחות ברקע, כך שהזמן הכולל קרוב לארוך מבין השניים.
+    """
+    profile = StageProfile(memory=profile_memory)
+    cache = get_parse_cache() if use_parse_cache else None
+    euro_names = upload_names(uploaded_euro)
+    euro_files = [(name, f.getvalue()) for name, f in zip(euro_names, uploaded_euro)]
+    leon_name, leon_data = uploaded_leon.name, uploaded_leon.getvalue()
+    ctx = get_script_run_ctx()
+
+    def load_leon():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        with profile.stage('leon_index') as measured:
+            leon_df, leon_index = get_leon_index(leon_hash, leon_name, leon_data)
+            measured['rows'] = len(leon_df)
+        return leon_index
+
+    # קוביות הסיכום של קבצים שכבר סוכמו (עם אותו לאון ואותן אפשרויות) לא נבנות שוב.
+    # סוג החיוב נקבע לפי שם הקובץ, ולכן אותו תוכן בשם אחר הוא קובייה אחרת
+    file_cubes = get_file_cubes()
+    cube_keys = {name: (file_hash(f), detect_charge_type(name), leon_hash, fuzzy_matching, use_ledger)
+                 for name, f in zip(euro_names, uploaded_euro)}
+    known_cubes = {name: file_cubes.get(key) for name, key in cube_keys.items()}
+    known_cubes = {name: cube for name, cube in known_cubes.items() if cube is not None}
+    new_cubes = {}
+
+    def aggregate(chunk):
+        with profile.stage('cube') as measured:
+            for name, rows in chunk.groupby('Source File', observed=True):
+                if name not in known_cubes:
+                    new_cubes[name] = merge_cubes([new_cubes.get(name), build_cube(rows)])
+                    measured['rows'] += len(rows)
+
+    progress = ParseProgress(euro_files)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        # 1. עיבוד לאון, במקביל לפענוח חשבוניות יורוקונטרול
+        leon_future = pool.submit(load_leon)
+        euro_chunks = ChunkPrefetcher(iter_euro_source(euro_files, workers=int(parse_workers), cache=cache),
+                                      on_chunk=progress.on_chunk, profile=profile)
+        try:
+            with profile.stage('leon_wait'):
+                while not wait([leon_future], timeout=0.25).done:
+                    progress.show(euro_chunks.finished, "loading")
+                leon_index = leon_future.result()
+        except Exception as e:
+            euro_chunks.close()
+            profile.close()
+            progress.clear()
+            st.error(f"Error reading Leon file: {e}")
+            st.stop()
+
+    def tracked(chunks):
+        for chunk in chunks:
+            progress.show(euro_chunks.finished, "ready")
+            yield chunk
+
+    # 2. התאמה לכל מקטע שפוענח
+    ledger = get_ledger() if use_ledger else None
+    try:
+        df_display, df_unmatched_export, summary = run_audit(tracked(euro_chunks), leon_index, fuzzy=fuzzy_matching,
+                                                             ledger=ledger, buffers=dict(euro_files), profile=profile,
+                                                             on_chunk=aggregate, parse_stage='parse_wait')
+    except ValueError as e:
+        profile.close()
+        st.error(str(e))
+        st.stop()
+    finally:
+        euro_chunks.close()
+        progress.clear()
+
+    if cache is not None:
+        cache_stats = cache.stats()
+        st.sidebar.caption(f"Parse cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, "
+                           f"{cache_stats['files']} files ({cache_stats['bytes'] / 1e6:.1f} MB)")
+
+    for name, cube in new_cubes.items():
+        file_cubes.put(cube_keys[name], cube)
+    with profile.stage('cube_merge'):
+        cube = merge_cubes([*known_cubes.values(), *new_cubes.values()])
+    profile.count({'cube_files_reused': len(known_cubes), 'cube_files_built': len(new_cubes)})
+
+    # 3. קבצי ההורדה נוצרים פעם אחת, כאן
+    if len(df_display) <= EXCEL_MAX_ROWS:
+        with profile.stage('generate_excel', rows=len(df_display)):
+            downloads = [
+                ("📥 Download Full Audit Report (Excel)", generate_excel(df_display, df_unmatched_export),
+                 'Audit_Report_Final.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+            ]
+    else:
+        # גדול מגיליון אקסל - הדו"ח יורד כ-CSV דחוס
+        with profile.stage('generate_csv_gz', rows=len(df_display)):
+            downloads = [
+                ("📥 Download Full Audit Report (CSV, gzip)", generate_csv_gz(df_display),
+                 'Audit_Report_Final.csv.gz', 'application/gzip'),
+                ("📥 Download Unmatched Investigation (CSV, gzip)", generate_csv_gz(df_unmatched_export),
+                 'Audit_Report_Final_unmatched.csv.gz', 'application/gzip'),
+            ]
+    profile.close()
+
+    return {
+        'df_display': df_display,
+        'df_unmatched': df_unmatched_export,
+        'summary': summary,
+        'billed_twice': ledger.duplicates(invoices=df_display['Invoice No'].unique()) if ledger else None,
+        'leon_duplicates': leon_index.duplicates,
+        'cube': cube,
+        'downloads': downloads,
+        'profile': profile.report(),
+    }
+
+def render_audit(audit):
+    df_display = audit['df_display']
+    df_unmatched_export = audit['df_unmatched']
+    summary = audit['summary']
+
+    st.success("Analysis Completed Successfully.")
+
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Total Flights", summary['total_flights'])
+    m2.metric("Total Amount", f"€{summary['total_amount']:,.2f}")
+    m3.metric("Matched Flights", summary['matched_flights'])
+    m4.metric("Match Rate", f"{summary['match_rate']:.1f}%")
+
+    st.caption("Parsed lines by path: " + ", ".join(
+        f"{path} {count:,}" for path, count in summary['parse_paths'].items()))
+
+    st.subheader("Invoice Details")
+
+    results_grid(df_display)
+
+    if not df_unmatched_export.empty:
+        review = summary.get('review_flights', 0)
+        st.warning(f"Found {len(df_unmatched_export)} unmatched flights"
+                   + (f" ({review} with only a low-confidence fuzzy match to review)." if review else "."))
+        with st.expander("Show Unmatched Details"):
+            st.dataframe(df_unmatched_export, hide_index=True)
+
+    billed_twice = audit['billed_twice']
+    if billed_twice is not None:
+        st.caption(f"{summary['ledger_hits']} lines were already reconciled in the ledger.")
+        if not billed_twice.empty:
+            st.warning(f"{len(billed_twice)} charges also appear on another invoice.")
+            with st.expander("Show Charges Invoiced Twice"):
+                st.dataframe(billed_twice, hide_index=True)
+
+    leon_duplicates = audit['leon_duplicates']
+    if not leon_duplicates.empty:
+        st.warning(f"Leon report has {len(leon_duplicates)} flights sharing a match key "
+                   "(the last Trip number is used).")
+        with st.expander("Show Duplicate Leon Keys"):
+            st.dataframe(leon_duplicates, hide_index=True)
+
+    for label, data, file_name, mime in audit['downloads']:
+        st.download_button(label=label, data=data, file_name=file_name, mime=mime)
+
+    render_cost_analytics(audit['cube'])
+
+    render_diagnostics(audit['profile'])
+
+@st.fragment
+def render_cost_analytics(cube):
+    """
+    סיכומי עלויות לפי ממד וחודשים, מתוך הקובייה שנשמרה עם הביקורת - כל שינוי בפקדים
+    מסכם טבלאות קטנות ולא עובר שוב על כל שורות החיובים.
+    """
+    if not cube:
+        return
+    st.subheader("Cost Analytics")
+    c1, c2 = st.columns([1, 2])
+    dimension = c1.selectbox("Group by", list(DIMENSIONS), key='cube_dimension')
+    months = c2.multiselect("Months", cube_months(cube), key='cube_months')
+
+    total, unmatched = exposure(cube, months)
+    m1, m2, m3 = st.columns(3)
+    m1.metric("Billed", f"€{total:,.2f}")
+    m2.metric("Unmatched Exposure", f"€{unmatched:,.2f}")
+    m3.metric("Exposure Share", f"{unmatched / total * 100:.1f}%" if total else "-")
+
+    view = cube_view(cube, dimension, months)
+    st.dataframe(view, use_container_width=True, hide_index=True)
+    st.download_button(f"Download {dimension} summary (CSV)", data=view.to_csv(index=False),
+                       file_name=f"cost_by_{dimension.lower().replace(' ', '_')}.csv", mime='text/csv')
+
+def render_diagnostics(report):
+    """זמני השלבים ומוני הפענוח של הביקורת, עם זמן ציור הטבלה האחרון"""
+    report = {**report, 'stages': dict(report['stages'])}
+    if 'grid_render' in st.session_state:
+        report['stages']['render_grid'] = st.session_state['grid_render']
+    with st.expander("Diagnostics"):
+        st.dataframe(pd.DataFrame.from_dict(report['stages'], orient='index'), use_container_width=True)
+        st.dataframe(pd.Series(report['counters'], name='count'), use_container_width=True)
+        st.download_button("Download diagnostics (JSON)", data=json.dumps(report, indent=2),
+                           file_name='audit_diagnostics.json', mime='application/json')
+
 if uploaded_euro and uploaded_leon:
+    # מפתח הביקורת: תוכן כל הקבצים והאפשרויות שמשפיעות על התוצאה
+    leon_hash = file_hash(uploaded_leon)
+    audit_key = hashlib.sha256(repr((
+        leon_hash,
+        [(f.name, file_hash(f)) for f in uploaded_euro],
+        fuzzy_matching,
+        use_ledger,
+    )).encode()).hexdigest()
+    audit_store = get_audit_store()
+
     if st.button("RUN AUDIT 🚀", type="primary"):
-        with st.spinner('Parsing Invoice & Matching Flights...'):
-            
-            euro_records = []
-            
-            for uploaded_file in uploaded_euro:
-                content = uploaded_file.getvalue().decode("utf-8", errors='ignore')
-                invoice_ref = extract_invoice_reference(content)
-                
-                for line in content.splitlines():
-                    parsed = parse_eurocontrol_line(line)
-                    if parsed:
-                        parsed['Invoice No'] = invoice_ref
-                        parsed['Source File'] = uploaded_file.name
-                        euro_records.append(parsed)
-            
-            if not euro_records:
-                st.error("No valid flight lines found inside the uploaded text files.")
-                st.stop()
-
-            euro_df = pd.DataFrame(euro_records)
-
-            # 2. עיבוד לאון
-            try:
-                if uploaded_leon.name.endswith('.csv'):
-                    try:
-                        leon_df = pd.read_csv(uploaded_leon)
-                    except UnicodeDecodeError:
-                        leon_df = pd.read_csv(uploaded_leon, encoding='latin1')
-                else:
-                    leon_df = pd.read_excel(uploaded_leon)
-                
-                leon_df.columns = [c.split('[')[0].strip() for c in leon_df.columns]
-                leon_df['Date ADEP'] = pd.to_datetime(leon_df['Date ADEP'], dayfirst=True, errors='coerce').dt.strftime('%Y-%m-%d')
-                
-                if 'Aircraft' in leon_df.columns:
-                    leon_df['Aircraft_Clean'] = leon_df['Aircraft'].astype(str).str.replace('-', '').str.replace(' ', '')
-                else:
-                    st.error("Missing 'Aircraft' column in Leon file.")
-                    st.stop()
-                
-                if 'Flight number' in leon_df.columns:
-                    leon_df['Flight_Clean'] = leon_df['Flight number'].astype(str).str.strip()
-                else:
-                    leon_df['Flight_Clean'] = ''
-
-            except Exception as e:
-                st.error(f"Error reading Leon file: {e}")
-                st.stop()
-
-            # 3. מנוע ההתאמה
-            euro_df['KEY_REG'] = (euro_df['Date'] + '_' + euro_df['Reg'] + '_' + euro_df['Dep'] + '_' + euro_df['Arr'])
-            leon_df['KEY_REG'] = (leon_df['Date ADEP'] + '_' + leon_df['Aircraft_Clean'] + '_' + leon_df['ADEP ICAO'] + '_' + leon_df['ADES ICAO'])
-            
-            euro_df['KEY_FLT'] = (euro_df['Date'] + '_' + euro_df['Callsign'] + '_' + euro_df['Dep'] + '_' + euro_df['Arr'])
-            leon_df['KEY_FLT'] = (leon_df['Date ADEP'] + '_' + leon_df['Flight_Clean'] + '_' + leon_df['ADEP ICAO'] + '_' + leon_df['ADES ICAO'])
-            
-            lookup_reg = leon_df.set_index('KEY_REG')['Trip number'].to_dict()
-            lookup_flt = leon_df.set_index('KEY_FLT')['Trip number'].to_dict()
-
-            euro_df['Leon Trip Number'] = euro_df['KEY_REG'].map(lookup_reg)
-            euro_df.loc[euro_df['Leon Trip Number'].isna(), 'Leon Trip Number'] = euro_df['KEY_FLT'].map(lookup_flt)
-            
-            euro_df['Matched?'] = 'NO'
-            euro_df.loc[euro_df['Leon Trip Number'].notna(), 'Matched?'] = 'YES'
-            
-            euro_df['Match Method'] = '-'
-            euro_df.loc[euro_df['KEY_REG'].map(lookup_reg).notna(), 'Match Method'] = 'Registration'
-            euro_df.loc[(euro_df['Match Method'] == '-') & (euro_df['KEY_FLT'].map(lookup_flt).notna()), 'Match Method'] = 'Flight Number'
-
-            # 4. הכנת הטבלה הסופית
-            final_columns = [
-                'Invoice No', 
-                'Date', 
-                'Reg', 
-                'Dep', 
-                'Arr', 
-                'Amount', 
-                'Leon Trip Number', 
-                'Matched?', 
-                'Match Method'
-            ]
-            
-            df_display = euro_df[final_columns].copy()
-            
-            df_unmatched = euro_df[euro_df['Matched?'] == 'NO'].copy()
-            unmatched_export_cols = final_columns + ['Raw_Line']
-            df_unmatched_export = df_unmatched[unmatched_export_cols]
-
-            # 5. דשבורד
-            st.success("Analysis Completed Successfully.")
-            
-            total_flights = len(euro_df)
-            matched_flights = len(euro_df[euro_df['Matched?'] == 'YES'])
-            match_rate = (matched_flights / total_flights) * 100 if total_flights > 0 else 0
-            total_amount = euro_df['Amount'].sum()
-
-            m1, m2, m3, m4 = st.columns(4)
-            m1.metric("Total Flights", total_flights)
-            m2.metric("Total Amount", f"€{total_amount:,.2f}")
-            m3.metric("Matched Flights", matched_flights)
-            m4.metric("Match Rate", f"{match_rate:.1f}%")
-
-            st.subheader("Invoice Details")
-            
-            def color_row(row):
-                return ['background-color: #d4edda'] * len(row) if row['Matched?'] == 'YES' else ['background-color: #f8d7da'] * len(row)
-
-            st.dataframe(
-                df_display.style.apply(color_row, axis=1),
-                use_container_width=True,
-                hide_index=True
-            )
-            
-            if not df_unmatched.empty:
-                st.warning(f"Found {len(df_unmatched)} unmatched flights.")
-                with st.expander("Show Unmatched Details"):
-                    st.dataframe(df_unmatched_export, hide_index=True)
-
-            excel_data = generate_excel(df_display, df_unmatched_export)
-            
-            st.download_button(
-                label="📥 Download Full Audit Report (Excel)",
-                data=excel_data,
-                file_name='Audit_Report_Final.xlsx',
-                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
+        audit = audit_store.get(audit_key)
+        if audit is None:
+            audit = compute_audit(leon_hash)
+            audit_store.put(audit_key, audit)
+        st.session_state['audit_key'] = audit_key
+
+    # התוצאות נשמרות בין הרצות חוזרות של הדף (הרחבת expander, הורדה וכו')
+    if st.session_state.get('audit_key') == audit_key:
+        audit = audit_store.get(audit_key)
+        if audit is None:
+            st.info("The results of this audit were released from memory - run the audit again.")
+        else:
+            render_audit(audit)
 
 else:
     st.info("Please upload Eurocontrol (TXT) and Leon (Excel/CSV) files to begin.")
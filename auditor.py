@@ -0,0 +1,421 @@
+"""
+שלבי הביקורת (פענוח, התאמה ודו"ח) כספרייה, בלי Streamlit, ונקודת כניסה לשורת הפקודה.
+
+    python auditor.py --euro PF_DIR [PF_DIR ...] --leon leon_report.xlsx --out Audit_Report.xlsx
+"""
+import argparse
+import hashlib
+import io
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from eurocontrol import (attach_raw_lines, close_pf_files, compact_columns, iter_eurocontrol_buffers,
+                         iter_eurocontrol_parallel, open_pf_file)
+from ledger import DEFAULT_LEDGER_PATH, Ledger
+from matching import LeonIndex, load_leon_report, match_flights
+from parse_cache import ParseCache, iter_eurocontrol_cached
+from profiling import StageProfile
+
+FINAL_COLUMNS = [
+    'Invoice No',
+    'Charge Type',
+    'Date',
+    'Reg',
+    'Dep',
+    'Arr',
+    'Amount',
+    'Leon Trip Number',
+    'Matched?',
+    'Match Method',
+    'Match Confidence',
+]
+
+def iter_euro_source(files, workers=1, cache=None):
+    """
+    בוחר את מסלול הפענוח: מטמון (אם נמסר), פענוח מקבילי, או קריאה זורמת בתהליך הנוכחי.
+    files הוא רשימת זוגות (שם קובץ, bytes או mmap).
+    """
+    if cache is not None:
+        return iter_eurocontrol_cached(files, cache, workers=workers)
+    if workers > 1:
+        return iter_eurocontrol_parallel(files, workers=workers)
+    return iter_eurocontrol_buffers(files)
+
+# מספר המקטעים המפוענחים שממתינים להתאמה (מגביל את הזיכרון של הפענוח ברקע)
+PREFETCH_CHUNKS = 8
+_PREFETCH_DONE = object()
+
+
+class ChunkPrefetcher:
+    """
+    מריץ את מקור המקטעים (פענוח) ב-thread ברקע לתוך תור מוגבל, כך שהפענוח ממשיך
+    בזמן שדוח לאון נטען ובזמן ההתאמה. on_chunk נקרא ב-thread של הפענוח לכל מקטע.
+    עם profile, זמן הפענוח עצמו נמדד ב-thread של הפענוח כשלב 'parse'.
+    חריגה בפענוח נזרקת מחדש בצד הצורך, ונשמרת ב-error כדי שאפשר יהיה לדעת שהיא מהפענוח.
+    close() עוצר את הפענוח אם הצרכן הפסיק באמצע.
+    """
+
+    def __init__(self, chunks, depth=PREFETCH_CHUNKS, on_chunk=None, profile=None):
+        self.finished = False
+        self.error = None
+        self._chunks = chunks
+        self._profile = profile
+        self._on_chunk = on_chunk
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, name='pf-parser', daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        chunks = self._chunks if self._profile is None else self._profile.iterate('parse', self._chunks)
+        try:
+            for chunk in chunks:
+                if self._on_chunk is not None:
+                    self._on_chunk(chunk)
+                if not self._put(chunk):
+                    return
+            self._put(_PREFETCH_DONE)
+        except Exception as e:
+            self.error = e
+            self._put(e)
+        finally:
+            self.finished = True
+            close = getattr(self._chunks, 'close', None)
+            if close is not None:
+                close()
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _PREFETCH_DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """עוצר את הפענוח ברקע ומחכה לסיומו (כולל סגירת תהליכי העבודה)"""
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+def load_leon_index(data, name, profile=None):
+    """טוען ומנרמל את דוח לאון ובונה את אינדקס ההתאמה (מתאים להרצה ב-thread נפרד)"""
+    profile = profile if profile is not None else StageProfile()
+    with profile.stage('leon_load') as measured:
+        leon_df = load_leon_report(data, name)
+        measured['rows'] = len(leon_df)
+    with profile.stage('key_build', rows=len(leon_df)):
+        leon_index = LeonIndex(leon_df, source_hash=hashlib.sha256(data).hexdigest())
+    return leon_df, leon_index
+
+def run_audit(euro_chunks, leon_index, fuzzy=True, ledger=None, buffers=None, profile=None, on_chunk=None,
+              parse_stage='parse'):
+    """
+    מתאים את מקטעי החשבונית מול לאון ומסכם את התוצאות.
+    עם ledger, שורות שכבר הותאמו במחזורים קודמים נלקחות מהיומן ולא מותאמות מחדש.
+    buffers (שם קובץ -> bytes) משמש לשחזור השורה הגולמית - רק לשורות שלא הותאמו
+    (או לכל השורות עם ledger). בלי buffers (ובלי Raw_Line במקטעים) נשמרים רק מיקומי השורות בקובץ.
+    profile (StageProfile) מקבל את זמני השלבים ואת מוני הפענוח. הזמן של קבלת כל מקטע נמדד כשלב parse_stage:
+    כשהמקטעים מגיעים מ-ChunkPrefetcher (שמודד את הפענוח בעצמו) זו ההמתנה לתור, ולכן 'parse_wait'.
+    on_chunk נקרא עם כל מקטע מותאם (כולל Source File ו-Amount_Cents), למשל לצבירת סיכומים.
+    מחזיר (טבלת הדו"ח, שורות לא מותאמות עם השורה הגולמית, מילון סיכומים).
+    """
+    if profile is None:
+        profile = StageProfile()
+    display_frames = []
+    unmatched_frames = []
+    total_flights = 0
+    matched_flights = 0
+    total_cents = 0
+    ledger_hits = 0
+    review_flights = 0
+    parse_paths = pd.Series(dtype='int64')
+    # טיולי לאון שכבר הותאמו במקטעים קודמים - התאמה סלחנית לא משתמשת בהם שוב
+    claimed = set()
+
+    for chunk in profile.iterate(parse_stage, euro_chunks):
+        profile.count(chunk.attrs.pop('parse_counts', {}))
+        if ledger is not None:
+            with profile.stage('ledger_match', rows=len(chunk)):
+                chunk = ledger.reconcile(attach_raw_lines(chunk, buffers), leon_index, fuzzy=fuzzy, claimed=claimed)
+            ledger_hits += int(chunk['From Ledger'].sum())
+        else:
+            with profile.stage('match', rows=len(chunk)):
+                chunk = match_flights(chunk, leon_index, fuzzy=fuzzy, claimed=claimed)
+        chunk['Amount'] = chunk['Amount_Cents'] / 100
+        if on_chunk is not None:
+            on_chunk(chunk)
+        is_matched = chunk['Matched?'] == 'YES'
+
+        total_flights += len(chunk)
+        matched_flights += int(is_matched.sum())
+        review_flights += int((chunk['Matched?'] == 'REVIEW').sum())
+        total_cents += int(chunk['Amount_Cents'].sum())
+        parse_paths = parse_paths.add(chunk['Parse Path'].value_counts(), fill_value=0)
+
+        display_frames.append(chunk[FINAL_COLUMNS])
+        unmatched = chunk[~is_matched]
+        if buffers is not None and 'Raw_Line' not in unmatched.columns:
+            with profile.stage('raw_lines', rows=len(unmatched)):
+                unmatched = attach_raw_lines(unmatched.copy(), buffers)
+        raw_columns = ['Raw_Line'] if 'Raw_Line' in unmatched.columns else ['Line_Start', 'Line_End']
+        unmatched_frames.append(unmatched[FINAL_COLUMNS + raw_columns])
+
+    if total_flights == 0:
+        raise ValueError("No valid flight lines found inside the uploaded text files.")
+
+    summary = {
+        'total_flights': total_flights,
+        'matched_flights': matched_flights,
+        'total_amount': total_cents / 100,
+        'match_rate': (matched_flights / total_flights) * 100,
+        'ledger_hits': ledger_hits,
+        'review_flights': review_flights,
+        'parse_paths': {path: int(count) for path, count in parse_paths.items() if count},
+    }
+    profile.count({'ledger_hits': ledger_hits})
+    with profile.stage('combine', rows=total_flights):
+        df_display = compact_columns(pd.concat(display_frames, ignore_index=True))
+        df_unmatched = compact_columns(pd.concat(unmatched_frames, ignore_index=True))
+    return df_display, df_unmatched, summary
+
+def filter_results(df, status='All', invoices=None, reg=None, date_range=None, sort_by=None, descending=False):
+    """
+    סינון ומיון של טבלת התוצאות (בצד השרת, בפעולות וקטוריות).
+    status: All / Matched / Unmatched (כולל REVIEW - התאמות סלחניות בביטחון נמוך). date_range: זוג תאריכים (כולל) או None.
+    """
+    mask = pd.Series(True, index=df.index)
+    if status == 'Matched':
+        mask &= df['Matched?'] == 'YES'
+    elif status == 'Unmatched':
+        mask &= df['Matched?'] != 'YES'
+    if invoices:
+        mask &= df['Invoice No'].isin(invoices)
+    if reg:
+        mask &= df['Reg'].astype(object).fillna('').astype(str).str.contains(reg, case=False, regex=False)
+    if date_range:
+        start, end = (pd.Timestamp(value) for value in date_range)
+        mask &= (df['Date'] >= start) & (df['Date'] <= end)
+
+    view = df[mask]
+    if sort_by:
+        view = view.sort_values(sort_by, ascending=not descending, kind='stable')
+    return view
+
+# מגבלת השורות של גיליון אקסל (בלי שורת הכותרת)
+EXCEL_MAX_ROWS = 1_048_575
+# מעל מספר שורות זה רוחב העמודות מחושב על מדגם ולא על כל הטבלה
+WIDTH_SAMPLE_ROWS = 100_000
+# מספר השורות שמומרות לערכי פייתון בכל פעם בכתיבה לאקסל
+EXCEL_WRITE_BLOCK = 50_000
+
+def column_widths(df):
+    """רוחב לכל עמודה לפי האורך המקסימלי של הערכים (כולל הכותרת), בחישוב וקטורי"""
+    sample = df if len(df) <= WIDTH_SAMPLE_ROWS else df.sample(WIDTH_SAMPLE_ROWS, random_state=0)
+    widths = []
+    for column in df.columns:
+        longest = sample[column].astype(str).str.len().max() if len(sample) else 0
+        widths.append(max(len(str(column)), int(longest)) + 2)
+    return widths
+
+def _write_sheet(workbook, title, df, autosize=False):
+    """כותב DataFrame לגיליון write-only: השורות נשלחות לקובץ בזרימה ולא נשמרות בזיכרון"""
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    worksheet = workbook.create_sheet(title)
+    if autosize:
+        for position, width in enumerate(column_widths(df), start=1):
+            worksheet.column_dimensions[get_column_letter(position)].width = width
+
+    header_font = Font(bold=True)
+    header = []
+    for column in df.columns:
+        cell = WriteOnlyCell(worksheet, value=str(column))
+        cell.font = header_font
+        header.append(cell)
+    worksheet.append(header)
+
+    for start in range(0, len(df), EXCEL_WRITE_BLOCK):
+        block = df.iloc[start:start + EXCEL_WRITE_BLOCK].copy()
+        # תאריכים נכתבים כתאריך אקסל בלי שעה
+        for column in block.select_dtypes('datetime').columns:
+            block[column] = block[column].dt.date
+        block = block.astype(object)
+        block = block.where(block.notna(), None)
+        for row in block.itertuples(index=False, name=None):
+            worksheet.append(row)
+
+def write_excel(df_main, df_unmatched, target):
+    """כותב את שני הגיליונות לקובץ אקסל (נתיב או אובייקט קובץ) במצב write-only"""
+    from openpyxl import Workbook
+
+    if max(len(df_main), len(df_unmatched)) > EXCEL_MAX_ROWS:
+        raise ValueError(f"Report has more than {EXCEL_MAX_ROWS:,} rows - use a .csv.gz or .parquet output.")
+
+    workbook = Workbook(write_only=True)
+    _write_sheet(workbook, 'Main Report', df_main, autosize=True)
+    if not df_unmatched.empty:
+        _write_sheet(workbook, 'Unmatched Investigation', df_unmatched)
+    workbook.save(target)
+
+def generate_excel(df_main, df_unmatched):
+    """מייצר קובץ אקסל אחד עם שני גיליונות"""
+    output = io.BytesIO()
+    write_excel(df_main, df_unmatched, output)
+    return output.getvalue()
+
+def generate_csv_gz(df):
+    """CSV דחוס ב-gzip (לדו"חות גדולים מגיליון אקסל)"""
+    output = io.BytesIO()
+    df.to_csv(output, index=False, compression='gzip')
+    return output.getvalue()
+
+def _sibling_path(path, suffix, ext=None):
+    """report.csv.gz -> report_unmatched.csv.gz (או סיומת אחרת אם ext נמסר)"""
+    directory, name = os.path.split(path)
+    stem, _, old_ext = name.partition('.')
+    ext = ext or old_ext
+    return os.path.join(directory, f"{stem}_{suffix}.{ext}" if ext else f"{stem}_{suffix}")
+
+def write_report(df_main, df_unmatched, path):
+    """
+    כותב את הדו"ח לפי סיומת הקובץ: xlsx (שני גיליונות), או csv / csv.gz / parquet
+    (לריצות גדולות) - שם שורות ה-Unmatched נכתבות לקובץ נוסף ליד הדו"ח.
+    """
+    lowered = path.lower()
+    if lowered.endswith(('.csv', '.csv.gz')):
+        df_main.to_csv(path, index=False)
+        df_unmatched.to_csv(_sibling_path(path, 'unmatched'), index=False)
+    elif lowered.endswith('.parquet'):
+        df_main.to_parquet(path, index=False)
+        df_unmatched.to_parquet(_sibling_path(path, 'unmatched'), index=False)
+    else:
+        write_excel(df_main, df_unmatched, path)
+
+def collect_pf_files(paths):
+    """מחזיר את קבצי ה-PF (txt) מתוך רשימת תיקיות/קבצים, ממוינים לפי שם"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names if name.lower().endswith('.txt'))
+        else:
+            files.append(path)
+    return sorted(files)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile Eurocontrol PF invoices against a Leon report.")
+    parser.add_argument('--euro', nargs='+', required=True, metavar='PATH',
+                        help="Eurocontrol PF files or directories of them (*.txt)")
+    parser.add_argument('--leon', required=True, help="Leon report (Excel/CSV)")
+    parser.add_argument('--out', default='Audit_Report_Final.xlsx',
+                        help="Report path (.xlsx, .csv, .csv.gz or .parquet)")
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('AUDITOR_WORKERS', os.cpu_count() or 1)),
+                        help="Parser processes (default: AUDITOR_WORKERS or CPU count)")
+    parser.add_argument('--no-fuzzy', action='store_true', help="Exact matching tiers only")
+    parser.add_argument('--no-cache', action='store_true', help="Do not use the on-disk parse cache")
+    parser.add_argument('--ledger', nargs='?', const=DEFAULT_LEDGER_PATH, metavar='DB',
+                        help="Reuse and record results in the reconciliation ledger (SQLite)")
+    parser.add_argument('--profile', metavar='JSON', help="Write stage timings and parser counters to this file")
+    parser.add_argument('--profile-memory', action='store_true',
+                        help="Also record peak memory per stage (tracemalloc, slower; stages that ran "
+                             "alongside another stage are counted as overlapped_calls instead)")
+    args = parser.parse_args(argv)
+
+    pf_paths = collect_pf_files(args.euro)
+    if not pf_paths:
+        print("No Eurocontrol files found.", file=sys.stderr)
+        return 1
+
+    profile = StageProfile(memory=args.profile_memory)
+    try:
+        with open(args.leon, 'rb') as leon_file:
+            leon_data = leon_file.read()
+    except OSError as e:
+        print(f"Error reading Leon file: {e!r}", file=sys.stderr)
+        return 1
+    # הנתיב המלא הוא שם הקובץ: קבצים עם אותו שם בתיקיות שונות לא מתערבבים בשחזור השורות
+    files = []
+    try:
+        for path in pf_paths:
+            files.append((path, open_pf_file(path)))
+    except OSError as e:
+        close_pf_files(files)
+        print(f"Error reading Eurocontrol file: {e!r}", file=sys.stderr)
+        return 1
+
+    cache = None if args.no_cache else ParseCache()
+    ledger = Ledger(args.ledger) if args.ledger else None
+    # דוח לאון נטען ב-thread נפרד בזמן שקבצי ה-PF מפוענחים ברקע
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        leon_future = executor.submit(load_leon_index, leon_data, os.path.basename(args.leon), profile)
+        euro_chunks = ChunkPrefetcher(iter_euro_source(files, workers=args.workers, cache=cache), profile=profile)
+        try:
+            with profile.stage('leon_wait'):
+                try:
+                    _, leon_index = leon_future.result()
+                except Exception as e:
+                    print(f"Error reading Leon file: {e!r}", file=sys.stderr)
+                    return 1
+            df_display, df_unmatched, summary = run_audit(euro_chunks, leon_index, fuzzy=not args.no_fuzzy,
+                                                          ledger=ledger, buffers=dict(files), profile=profile,
+                                                          parse_stage='parse_wait')
+            with profile.stage('write_report', rows=len(df_display)):
+                write_report(df_display, df_unmatched, args.out)
+        except Exception as e:
+            # חריגה מהפענוח ברקע (קובץ PF שלא נקרא או לא פוענח) מדווחת כמו שגיאת לאון
+            if e is euro_chunks.error:
+                print(f"Error reading Eurocontrol files: {e!r}", file=sys.stderr)
+                return 1
+            if isinstance(e, ValueError):
+                print(e, file=sys.stderr)
+                return 1
+            raise
+        finally:
+            euro_chunks.close()
+            profile.close()
+            close_pf_files(files)
+
+    print(f"{len(pf_paths)} files, {summary['total_flights']} flights, "
+          f"€{summary['total_amount']:,.2f}, {summary['matched_flights']} matched "
+          f"({summary['match_rate']:.1f}%) -> {args.out}")
+    if summary['review_flights']:
+        print(f"{summary['review_flights']} low-confidence fuzzy matches marked REVIEW (in the unmatched report)")
+    print("Parse paths: " + ", ".join(f"{path} {count}" for path, count in summary['parse_paths'].items()))
+    if ledger is not None:
+        duplicates = ledger.duplicates(invoices=df_display['Invoice No'].unique())
+        print(f"Ledger: {summary['ledger_hits']} lines reused, "
+              f"{len(duplicates)} charges also billed on another invoice")
+        if not duplicates.empty:
+            duplicates_path = _sibling_path(args.out, 'billed_twice', ext='csv')
+            duplicates.to_csv(duplicates_path, index=False)
+            print(f"  -> {duplicates_path}")
+    if args.profile:
+        with open(args.profile, 'w') as profile_file:
+            profile_file.write(profile.to_json())
+        for name, stage in profile.report()['stages'].items():
+            print(f"  {name:<13} {stage['seconds']:>9.3f}s {stage['rows']:>10} rows", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+מדידת ביצועים של שלבי הביקורת על נתונים סינתטיים.
+
+    python bench.py --sizes 1000 100000 1000000 --out bench.json
+    python bench.py --sizes 100000 --compare bench.json
+    python bench.py --sizes 100000 --leon-format xlsx
+
+הנתונים נוצרים עם seed קבוע, כך שדו"חות JSON מהרצות שונות ניתנים להשוואה.
+"""
+import argparse
+import io
+import json
+import platform
+import sys
+
+import numpy as np
+import pandas as pd
+
+from auditor import EXCEL_MAX_ROWS, generate_excel
+from eurocontrol import PARSER_VERSION, detect_layout, invoice_total_cents, parse_eurocontrol_bytes
+from matching import LeonIndex, load_leon_report, match_flights
+from profiling import StageProfile
+
+AIRPORTS = ['LLBG', 'EGLL', 'LFPG', 'EDDF', 'LIRF', 'LEMD', 'EHAM', 'LSZH', 'LOWW', 'LGAV',
+            'EGSS', 'LFMN', 'EDDM', 'LIMC', 'LEBL', 'EIDW', 'EKCH', 'ESSA', 'LPPT', 'LKPR']
+
+# פורמטים של דוח לאון (כמו שמועלה: CSV או אקסל) -> שם הקובץ שנמסר לטעינה
+LEON_FORMATS = {'csv': 'leon.csv', 'xlsx': 'leon.xlsx'}
+
+def generate_dataset(n, seed=0, leon_coverage=0.9, leon_format='csv'):
+    """
+    מייצר n שורות PF ברוחב קבוע ('01' ב-[7:9], תאריך ב-[9:19], זהות ב-[25:35], מסלול ב-[38:46],
+    יחידות ואחריהן החיוב, עם פסיק עשרוני), רשומת סיכום TOTAL בסוף, ודוח לאון תואם ל-leon_coverage מהטיסות.
+    מחזיר (bytes של קובץ PF, bytes של דוח לאון ב-leon_format: csv או xlsx).
+    """
+    rng = np.random.default_rng(seed)
+    fleet_size = max(10, n // 500)
+    letters = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+    fleet = np.array(['4X-' + ''.join(rng.choice(letters, 3)) for _ in range(fleet_size)])
+    callsigns = np.array([f"ELY{i:03d}" for i in range(1, fleet_size + 1)])
+
+    aircraft = rng.integers(0, fleet_size, n)
+    dates = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 366, n), unit='D')
+    legs = rng.choice(len(AIRPORTS), size=(n, 2))
+    legs[:, 1] = (legs[:, 0] + 1 + legs[:, 1] % (len(AIRPORTS) - 1)) % len(AIRPORTS)
+    dep = np.array(AIRPORTS)[legs[:, 0]]
+    arr = np.array(AIRPORTS)[legs[:, 1]]
+    by_reg = rng.random(n) < 0.6
+    identity = np.where(by_reg, np.char.replace(fleet[aircraft], '-', ''), callsigns[aircraft])
+    units = rng.integers(1, 400, n)
+    cents = rng.integers(100, 900_000, n)
+
+    pf_dates = dates.strftime('%Y/%m/%d')
+    lines = ['EUROCONTROL CRCO  ROUTE CHARGES', f"INVOICE GM/{seed:09d}/24", '']
+    lines.extend(
+        f"A{i % 1_000_000:06d}01{d}      {ident:<10}   {a}{b}         {u:>4},00  {c // 100:>8},{c % 100:02d}"
+        for i, (d, ident, a, b, u, c) in enumerate(zip(pf_dates, identity, dep, arr, units, cents))
+    )
+    lines.append(f"A99999902TOTAL {cents.sum() // 100},{cents.sum() % 100:02d}")
+    pf_bytes = '\r\n'.join(lines).encode('utf-8')
+
+    in_leon = rng.random(n) < leon_coverage
+    leon = pd.DataFrame({
+        'Date ADEP [UTC]': dates[in_leon].strftime('%d/%m/%Y'),
+        'Aircraft': fleet[aircraft][in_leon],
+        'Flight number': callsigns[aircraft][in_leon],
+        'ADEP ICAO': dep[in_leon],
+        'ADES ICAO': arr[in_leon],
+        'Trip number': np.arange(in_leon.sum()) + 100_000,
+    }).sample(frac=1.0, random_state=seed)
+    if leon_format == 'xlsx':
+        leon_file = io.BytesIO()
+        leon.to_excel(leon_file, index=False, engine='openpyxl')
+        return pf_bytes, leon_file.getvalue()
+    return pf_bytes, leon.to_csv(index=False).encode('utf-8')
+
+def bench_size(n, seed=0, memory=False, leon_format='csv'):
+    """
+    מריץ את כל השלבים על n שורות ומחזיר את זמני השלבים ומוני הפענוח.
+    leon_load מודד את קריאת דוח לאון בפורמט leon_format (ב-xlsx זה pd.read_excel).
+    """
+    pf_bytes, leon_data = generate_dataset(n, seed=seed, leon_format=leon_format)
+    profile = StageProfile(memory=memory)
+
+    _, layout = detect_layout('A_BENCH.txt', pf_bytes)
+    with profile.stage('parse', rows=pf_bytes.count(b'\n') + 1):
+        euro_df = parse_eurocontrol_bytes(pf_bytes, layout=layout)
+    profile.count(euro_df.attrs.pop('parse_counts'))
+    # הסכומים שפוענחו חייבים להסתכם לרשומת הסיכום של החשבונית - אחרת נמדד פענוח של עמודה שגויה
+    parsed_total, invoice_total = int(euro_df['Amount_Cents'].sum()), invoice_total_cents(pf_bytes)
+    if parsed_total != invoice_total:
+        raise RuntimeError(f"{n} rows: parsed amounts sum to {parsed_total / 100:.2f}, "
+                           f"invoice TOTAL is {invoice_total / 100:.2f}")
+    with profile.stage('leon_load') as measured:
+        leon_df = load_leon_report(leon_data, LEON_FORMATS[leon_format])
+        measured['rows'] = len(leon_df)
+    with profile.stage('key_build', rows=len(leon_df)):
+        leon_index = LeonIndex(leon_df)
+    with profile.stage('match', rows=len(euro_df)):
+        euro_df = match_flights(euro_df, leon_index)
+
+    # מעל מגבלת השורות של אקסל שלב הייצוא לא נמדד
+    if len(euro_df) <= EXCEL_MAX_ROWS:
+        euro_df['Amount'] = euro_df['Amount_Cents'] / 100
+        unmatched = euro_df[euro_df['Matched?'] != 'YES']
+        with profile.stage('generate_excel', rows=len(euro_df)):
+            generate_excel(euro_df, unmatched)
+    profile.close()
+
+    report = profile.report()
+    return {
+        'rows': n,
+        'leon_format': leon_format,
+        'parsed_rows': len(euro_df),
+        'match_rate': round(float((euro_df['Matched?'] == 'YES').mean()), 4),
+        'memory_bytes': int(euro_df.memory_usage(deep=True).sum()),
+        'stages': report['stages'],
+        'counters': report['counters'],
+    }
+
+def compare_reports(current, previous):
+    """מדפיס יחס זמנים לכל שלב מול דו"ח קודם (מעל 1 = איטי יותר עכשיו)"""
+    previous_sizes = {run['rows']: run for run in previous['runs']}
+    for run in current['runs']:
+        before = previous_sizes.get(run['rows'])
+        if before is None:
+            continue
+        if before.get('leon_format', 'csv') != run['leon_format']:
+            print(f"{run['rows']:>9} leon_load compares {before.get('leon_format', 'csv')} with {run['leon_format']}")
+        for stage, timing in run['stages'].items():
+            old = before['stages'].get(stage)
+            if old and old['seconds']:
+                print(f"{run['rows']:>9} {stage:<15} {old['seconds']:>9.3f}s -> {timing['seconds']:>9.3f}s "
+                      f"x{timing['seconds'] / old['seconds']:.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the invoice reconciler on synthetic data.")
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1_000, 10_000, 100_000],
+                        help="Invoice line counts to benchmark (e.g. 1000 ... 5000000)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help="Write the JSON report to this path (default: stdout)")
+    parser.add_argument('--compare', help="Previous JSON report to compare against")
+    parser.add_argument('--memory', action='store_true', help="Record peak memory per stage (tracemalloc, slower)")
+    parser.add_argument('--leon-format', choices=LEON_FORMATS, default='csv',
+                        help="Leon report format to generate and load (xlsx times pd.read_excel)")
+    args = parser.parse_args(argv)
+    if args.leon_format == 'xlsx' and max(args.sizes) > EXCEL_MAX_ROWS:
+        parser.error(f"--leon-format xlsx: an Excel sheet holds at most {EXCEL_MAX_ROWS} rows")
+
+    report = {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'parser_version': PARSER_VERSION,
+        'seed': args.seed,
+        'runs': [],
+    }
+    for n in args.sizes:
+        report['runs'].append(bench_size(n, seed=args.seed, memory=args.memory, leon_format=args.leon_format))
+        print(f"{n} rows done", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as out_file:
+            out_file.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            compare_reports(report, json.load(previous_file))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
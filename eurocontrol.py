@@ -0,0 +1,669 @@
+"""
+פענוח קבצי PF של יורוקונטרול.
+המודול נפרד מ-app.py כדי שתהליכי עבודה (ProcessPoolExecutor) יוכלו לייבא את פונקציות הפענוח.
+"""
+import itertools
+import mmap
+import multiprocessing
+import os
+import re
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+# גרסת כללי הפענוח - יש להעלות בכל שינוי בפענוח כדי לפסול תוצאות שמורות במטמון
+PARSER_VERSION = '7'
+
+def extract_invoice_reference(content):
+    """
+    מחלץ את מספר החשבונית. תומך גם בקידומת מספרית (31/...) וגם באותיות (GM/..., HE/...)
+    מקבל את תוכן הקובץ כטקסט, או את שורות הכותרת בלבד (בקריאה זורמת).
+    """
+    if isinstance(content, str):
+        lines = content.splitlines()[:3]
+    else:
+        lines = itertools.islice(content, 3)
+    for line in lines:
+        match = re.search(r'([A-Z0-9]{2}/\d{5,12}/\d{2})', line)
+        if match:
+            return match.group(1)
+    return "UNKNOWN_REF"
+
+def parse_eurocontrol_line(line_str):
+    try:
+        if len(line_str) < 10: return None
+        if isinstance(line_str, bytes):
+            line = line_str.decode('utf-8', errors='ignore')
+        else:
+            line = line_str
+            
+        if line[7:9] != '01': return None
+
+        # 1. חילוץ נתונים בסיסיים
+        flight_date = line[9:19].replace('/', '-')
+        
+        # הזהות המופיעה בקובץ (יכול להיות רישום ויכול להיות Callsign)
+        raw_identity = line[25:35].split()[0].strip()
+
+        # זיהוי מסלול
+        route_match = re.search(r'([A-Z]{4}[A-Z]{4})', line[35:55])
+        if route_match:
+            route_block = route_match.group(1)
+            dep_icao = route_block[0:4]
+            arr_icao = route_block[4:8]
+        else:
+            dep_icao = line[38:42].strip()
+            arr_icao = line[42:46].strip()
+
+        # --- התיקון לרישום המטוס ---
+        reg = None
+        # נסיון א': חיפוש רישום תקני (4X או N)
+        reg_match = re.search(r'(4X-?[A-Z]{3}|N[0-9]{1,5}[A-Z]{0,2})', line)
+        
+        if reg_match:
+            reg = reg_match.group(1).replace('-', '')
+        else:
+            # נסיון ב' (התיקון): אם אין רישום תקני, קח את מה שמופיע בעמודת הזהות (למשל HEZ333)
+            if raw_identity:
+                reg = raw_identity
+            else:
+                reg = 'UNKNOWN'
+
+        # זיהוי סכום
+        amount = Decimal("0.00")
+        amount_zone = line[35:]
+        decimal_matches = re.findall(r'(\d+,\d+)', amount_zone)
+        candidates = []
+        for m in decimal_matches:
+            val = Decimal(m.replace(',', '.'))
+            if val > 0: candidates.append(val)
+        
+        if not candidates:
+            int_matches = re.findall(r'\s(\d+)\s', amount_zone)
+            for m in int_matches:
+                val = Decimal(m)
+                if val > 0: candidates.append(val)
+        if candidates:
+            amount = candidates[0]
+
+        return {
+            'Date': flight_date,
+            'Callsign': raw_identity, # נשמור את המקור גם כאן
+            'Reg': reg,
+            'Dep': dep_icao,
+            'Arr': arr_icao,
+            'Amount': float(amount),
+            'Raw_Line': line.strip()
+        }
+    except Exception:
+        return None
+
+# תבניות מקומפלות מראש לפענוח המרוכז (אותם כללים כמו parse_eurocontrol_line)
+ROUTE_PATTERN = re.compile(r'([A-Z]{4}[A-Z]{4})')
+REG_PATTERN = re.compile(r'(4X-?[A-Z]{3}|N[0-9]{1,5}[A-Z]{0,2})')
+DECIMAL_PATTERN = re.compile(r'(\d+,\d+)')
+INTEGER_PATTERN = re.compile(r'\s(\d+)\s')
+
+EURO_COLUMNS = ['Date', 'Callsign', 'Reg', 'Dep', 'Arr', 'Amount_Cents', 'Parse Path', 'Line_Start', 'Line_End']
+# עמודות טקסט עם מעט ערכים שונים - נשמרות כ-category (קוד מספרי לכל שורה)
+CATEGORY_COLUMNS = ['Callsign', 'Reg', 'Dep', 'Arr', 'Parse Path', 'Charge Type', 'Invoice No', 'Source File']
+
+def detect_charge_type(filename):
+    """סוג החיוב לפי קידומת שם הקובץ (כמו בגרסה הקודמת של האפליקציה); מנתיב נלקח רק שם הקובץ"""
+    fname = os.path.basename(filename).upper()
+    if fname.startswith('AIC'): return 'Shanwick/Oceanic'
+    elif fname.startswith('M') or fname.startswith('B'): return 'Terminal/Other'
+    elif fname.startswith('A'): return 'Route Charges'
+    return 'Unknown'
+
+# פריסת עמודות קבועה (התחלה, סוף) בשורת רשומה '01' לכל סוג חיוב מוכר.
+# עמודת הסכום לא קבועה בין קבצים ונמדדת פעם אחת לכל קובץ (detect_layout), ונבדקת מול
+# רשומת הסיכום של החשבונית כשלפניה יש בשורה שדות מספריים אחרים (למשל יחידות).
+# סוג שאינו ברשימה מפוענח רק בכללים ההיוריסטיים.
+_PF_BASE_LAYOUT = {'date': (9, 19), 'identity': (25, 35), 'route': (38, 46)}
+CHARGE_LAYOUTS = {
+    'Route Charges': _PF_BASE_LAYOUT,
+    'Terminal/Other': _PF_BASE_LAYOUT,
+    'Shanwick/Oceanic': _PF_BASE_LAYOUT,
+}
+# כמות הבתים מתחילת הקובץ שבה מחפשים את עמודת הסכום, ומספר שורות הרשומה שנבדקות
+LAYOUT_SAMPLE_BYTES = 64 * 1024
+LAYOUT_SAMPLE_LINES = 200
+# שיעור שורות הדגימה שצריכות להסכים על מיקום הסכום כדי שהעמודה תיחשב קבועה
+LAYOUT_MIN_AGREEMENT = 0.8
+# רשומת הסיכום ('02') בסוף הקובץ: TOTAL והסכום הכולל של החשבונית
+TOTAL_PATTERN = re.compile(r'TOTAL\s+(\d+,\d+)')
+
+def to_datetime_ns(values, **kwargs):
+    """
+    pd.to_datetime עם errors='coerce' שמחזיר תמיד datetime64[ns]: גם תאריך מחוץ לטווח
+    (למשל שנה 2924 משורה פגומה) הופך ל-NaT במקום לעצור את כל הפענוח.
+    """
+    dates = pd.to_datetime(values, errors='coerce', **kwargs)
+    return dates.where((dates >= pd.Timestamp.min) & (dates <= pd.Timestamp.max)).astype('datetime64[ns]')
+
+def compact_columns(df):
+    """ממיר את עמודות הטקסט החוזרות ל-category (גם אחרי concat שמחזיר אותן ל-object)"""
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    return df
+
+def _agreed_column(spans):
+    """
+    (התחלה, סוף, יישור) אם רוב השדות מסכימים על תחילת השדה או על סופו, אחרת None.
+    כששני הצדדים עוברים את הסף נבחר הצד שעליו מסכימים יותר שדות (בשוויון - שמאל).
+    """
+    best = None
+    for align, edge in (('left', 0), ('right', 1)):
+        if not spans:
+            break
+        position, count = Counter(span[edge] for span in spans).most_common(1)[0]
+        if count >= LAYOUT_MIN_AGREEMENT * len(spans) and (best is None or count > best[3]):
+            best = (align, edge, position, count)
+    if best is None:
+        return None
+    align, edge, position, _ = best
+    width = max(end - start for start, end in spans if (start, end)[edge] == position)
+    return (position, position + width, align) if align == 'left' else (position - width, position, align)
+
+def _amount_columns(lines):
+    """
+    העמודות האפשריות לסכום בשורות הדגימה, משמאל לימין: (index, עמודה) - הסכום החיובי הראשון
+    החל מהמספר העשרוני ה-index בשורה. index=0 הוא הכלל ההיוריסטי (הסכום החיובי הראשון).
+    """
+    numbers = [[(match.span(), float(match.group(1).replace(',', '.')) > 0)
+                for match in DECIMAL_PATTERN.finditer(line, 35)] for line in lines]
+    columns = []
+    for index in range(max(map(len, numbers), default=0)):
+        spans = [next((span for span, positive in found[index:] if positive), None) for found in numbers]
+        column = _agreed_column([span for span in spans if span is not None])
+        if column is not None and column not in [known for _, known in columns]:
+            columns.append((index, column))
+    return columns
+
+def invoice_total_cents(data):
+    """הסכום הכולל מרשומת הסיכום ('02') בסוף הקובץ, באגורות, או None אם אין כזו"""
+    tail = bytes(data[-LAYOUT_SAMPLE_BYTES:]).decode('utf-8', errors='ignore').splitlines()
+    for line in reversed(tail):
+        match = TOTAL_PATTERN.search(line) if line[7:9] == '02' else None
+        if match:
+            whole, fraction = match.group(1).split(',')
+            return int(whole) * 100 + int(fraction.ljust(2, '0')[:2])
+    return None
+
+# כמה בתים מעבר לסוף של עמודה אפשרית נקראים בבדיקה מול הסכום הכולל (סכום רחב מהדגימה)
+TOTAL_CHECK_MARGIN = 16
+
+def _column_total_cents(data, column):
+    """
+    סכום עמודת סכום אפשרית בכל רשומות הקובץ, באגורות, ישירות ממערך הבתים: בכל שורה נלקח
+    המספר שעובר בקצה המיושר של העמודה (תחילתה או סופה), גם אם הוא רחב מהעמודה.
+    שדה שאינו מספר נספר כאפס, ולכן עמודה שגויה לא תתאים לסכום הכולל.
+    """
+    start, end, align = column
+    edge = (start if align == 'left' else end - 1) - 35
+    buf = np.frombuffer(data, dtype=np.uint8)
+    starts, ends = _line_bounds(buf)
+    rows = np.flatnonzero(_record_lines(buf, starts, ends))
+    columns = np.arange(35, end + TOTAL_CHECK_MARGIN)
+    total = 0
+    for first in range(0, len(rows), GATHER_BLOCK_LINES):
+        block_rows = rows[first:first + GATHER_BLOCK_LINES]
+        index = starts[block_rows, None] + columns
+        inside = index < ends[block_rows, None]
+        block = np.where(inside, buf[np.minimum(index, len(buf) - 1)], ord(' ')).astype(np.uint8)
+        # משאירים רק את המילה שעוברת בקצה המיושר (בין הרווח שלפניו לרווח שאחריו)
+        space = block == ord(' ')
+        before, after = space[:, edge::-1], space[:, edge + 1:]
+        left = np.where(before.any(axis=1), edge - before.argmax(axis=1), -1)
+        right = np.where(after.any(axis=1), edge + 1 + after.argmax(axis=1), len(columns))
+        positions = np.arange(len(columns))
+        block[(positions <= left[:, None]) | (positions >= right[:, None])] = ord(' ')
+        block[block == ord(',')] = ord('.')
+        fields = block.view(f'S{len(columns)}').ravel()
+        try:
+            values = fields.astype(float)
+        except ValueError:
+            values = pd.to_numeric(pd.Series(fields).str.decode('utf-8', errors='ignore'), errors='coerce').fillna(0).to_numpy()
+        total += int(np.rint(values * 100).sum())
+    return total
+
+def detect_layout(name, data):
+    """
+    מזהה פעם אחת לכל קובץ את סוג החיוב ואת פריסת העמודות שלו.
+    מחזיר (סוג החיוב, פריסה) - הפריסה היא None לסוג לא מוכר או כשעמודת הסכום לא קבועה.
+    כשיש יותר מעמודה אפשרית אחת לסכום (למשל יחידות עם פסיק לפני החיוב) ובקובץ יש רשומת
+    סיכום, נבחרת העמודה שסכומה שווה לסכום הכולל; בלי התאמה נשאר הכלל ההיוריסטי.
+    """
+    charge_type = detect_charge_type(name)
+    layout = CHARGE_LAYOUTS.get(charge_type)
+    if layout is None:
+        return charge_type, None
+    sample = bytes(data[:LAYOUT_SAMPLE_BYTES]).decode('utf-8', errors='ignore').splitlines()
+    records = [line for line in sample if len(line) >= 10 and line[7:9] == '01'][:LAYOUT_SAMPLE_LINES]
+    columns = _amount_columns(records)
+    total = invoice_total_cents(data) if len(columns) > 1 else None
+    if total is not None:
+        checked = [(index, column) for index, column in columns if _column_total_cents(data, column) == total]
+        columns = checked or columns
+    if not columns or (columns[0][0] != 0 and total is None):
+        return charge_type, None
+    index, amount = columns[0]
+    return charge_type, {**layout, 'amount': amount, 'amount_index': index}
+
+def _first_positive_cents(amount_zone, pattern, first_match=0):
+    """מחזיר את הסכום החיובי הראשון (החל מההתאמה ה-first_match) בכל שורה, באגורות (int64), לפי אינדקס השורה"""
+    found = amount_zone.str.extractall(pattern)[0].str.replace(',', '.', regex=False).astype(float)
+    found = found[(found > 0) & (found.index.get_level_values('match') >= first_match)]
+    return np.rint(found * 100).astype('int64').groupby(level=0).first()
+
+def _parse_heuristic(lines, amount_index=0):
+    """
+    הכללים ההיוריסטיים (חיפוש מסלול, רישום וסכום בכל השורה) - לשורות בפריסה לא מוכרת.
+    amount_index: מאיזה מספר עשרוני בשורה מתחיל חיפוש הסכום (מהפריסה של הקובץ).
+    מחזיר (DataFrame, מונים): שורות שנפסלו ושורות שבהן נדרשה ברירת המחדל של כל שדה.
+    """
+    # שורה ללא זהות בעמודות 25-35 נפסלת (כמו ה-except בפענוח הבודד)
+    identity = lines.str.slice(25, 35).str.split().str[0]
+    rejected = int(identity.isna().sum())
+    lines = lines[identity.notna()]
+    identity = identity[identity.notna()]
+
+    route = lines.str.slice(35, 55).str.extract(ROUTE_PATTERN)[0]
+    dep = route.str.slice(0, 4).fillna(lines.str.slice(38, 42).str.strip())
+    arr = route.str.slice(4, 8).fillna(lines.str.slice(42, 46).str.strip())
+
+    reg = lines.str.extract(REG_PATTERN)[0].str.replace('-', '', regex=False)
+    reg_missing = int(reg.isna().sum())
+    reg = reg.fillna(identity)
+
+    amount_zone = lines.str.slice(35)
+    cents = _first_positive_cents(amount_zone, DECIMAL_PATTERN, amount_index)
+    missing = amount_zone[~amount_zone.index.isin(cents.index)]
+    integer_cents = _first_positive_cents(missing, INTEGER_PATTERN)
+    cents = pd.concat([cents, integer_cents])
+
+    counts = {
+        'rejected_no_identity': rejected,
+        'route_fallback': int(route.isna().sum()),
+        'reg_from_identity': reg_missing,
+        'amount_integer_fallback': len(integer_cents),
+        'amount_missing': len(missing) - len(integer_cents),
+    }
+    parsed = pd.DataFrame({
+        'Dates': lines.str.slice(9, 19),
+        'Callsign': identity,
+        'Reg': reg,
+        'Dep': dep,
+        'Arr': arr,
+        'Amount_Cents': cents.reindex(lines.index, fill_value=0).astype('int64'),
+    })
+    return parsed, counts
+
+def _parse_fixed(lines, layout, reg_candidates=None):
+    """
+    פענוח לפי עמודות קבועות. מחזיר (DataFrame, מסכה של השורות שפוענחו) - שורה שאחד השדות
+    בה לא תואם לפריסה (זהות עם רווח, מסלול שאינו 8 אותיות, סכום לא מספרי, אפס או רחב מהעמודה)
+    לא נכללת, ועוברת לכללים ההיוריסטיים. הרישום נלקח מאותו חיפוש 4X/N על כל השורה כמו בפענוח הבודד,
+    רק בשורות שיש בהן מועמד לרישום (reg_candidates, אם כבר חושב על הבתים).
+    """
+    identity = lines.str.slice(*layout['identity']).str.strip()
+    route_start, route_end = layout['route']
+    route = lines.str.slice(route_start, route_end)
+    # מסלול שמתחיל לפני העמודה (אותיות צמודות משמאל) נמצא על ידי החיפוש ההיוריסטי במקום אחר
+    before_route = lines.str.slice(route_start - 1, route_start)
+
+    amount_start, amount_end, align = layout['amount']
+    field = lines.str.slice(amount_start, amount_end)
+    if align == 'left':
+        amount = field.str.split(' ', n=1).str[0]
+    else:
+        amount = field.str.rsplit(' ', n=1).str[-1]
+    digits = amount.str.replace(',', '', n=1, regex=False)
+    # סכום שממלא את כל העמודה עלול להמשיך מחוץ לה (רחב מהסכומים בדגימה) - הוא תקין רק אם
+    # התו שמעבר לקצה הפתוח הוא רווח או סוף השורה. לפני העמודה לא יכול להופיע סכום אחר.
+    open_edge = (lines.str.slice(amount_start - 1, amount_start) if align == 'right'
+                 else lines.str.slice(amount_end, amount_end + 1))
+    closed_edge = (lines.str.slice(amount_end, amount_end + 1) if align == 'right'
+                   else lines.str.slice(amount_start - 1, amount_start))
+    fills_field = amount.str.len() == amount_end - amount_start
+    # לפני העמודה יש בדיוק amount_index מספרים עשרוניים (וכל פסיק שם שייך לאחד מהם)
+    amount_index = layout.get('amount_index', 0)
+    before = lines.str.slice(35, amount_start)
+    if amount_index:
+        preceding = (before.str.count(',') == amount_index) & (before.str.count(DECIMAL_PATTERN) == amount_index)
+    else:
+        preceding = ~before.str.contains(',', regex=False)
+    bounded = closed_edge.isin([' ', '']) & (~fills_field | open_edge.isin([' ', ''])) & preceding
+
+    valid = ((identity != '') & ~identity.str.contains(' ', regex=False)
+             & (route.str.len() == route_end - route_start) & route.str.isascii()
+             & route.str.isalpha() & route.str.isupper() & ~before_route.str.isupper()
+             & digits.str.isascii() & digits.str.isdigit() & (amount.str.len() == digits.str.len() + 1)
+             & ~amount.str.startswith(',') & ~amount.str.endswith(',') & bounded)
+    cents = np.rint(amount.where(valid, '0').str.replace(',', '.', regex=False).astype(float) * 100).astype('int64')
+    valid &= cents > 0
+    lines, identity, route, cents = lines[valid], identity[valid], route[valid], cents[valid]
+
+    # החיפוש המלא רץ רק על שורות שיש בהן בכלל מועמד לרישום (4X, או N ואחריה ספרה)
+    if reg_candidates is None:
+        candidates = lines.str.contains('4X', regex=False) | lines.str.contains(r'N\d')
+    else:
+        candidates = reg_candidates[lines.index]
+    reg = lines[candidates].str.extract(REG_PATTERN)[0].str.replace('-', '', regex=False)
+    parsed = pd.DataFrame({
+        'Dates': lines.str.slice(*layout['date']),
+        'Callsign': identity,
+        'Reg': reg.reindex(lines.index).fillna(identity),
+        'Dep': route.str.slice(0, 4),
+        'Arr': route.str.slice(4, 8),
+        'Amount_Cents': cents,
+    })
+    return parsed, valid
+
+def parse_eurocontrol_lines(lines, offsets=None, layout=None, reg_candidates=None):
+    """
+    פענוח מרוכז של כל שורות הקובץ בבת אחת, ללא לולאת פייתון לכל שורה.
+    עם layout (מ-detect_layout) שורות שתואמות לפריסה מפוענחות לפי עמודות קבועות,
+    והשאר לפי אותם כללים כמו parse_eurocontrol_line. עמודת Parse Path מציינת את המסלול.
+    הסכמה חסכונית: Date כ-datetime64, זהות ושדות ICAO כ-category וסכום באגורות (Amount_Cents).
+    offsets: זוגות (התחלה, סוף) בבתים של כל שורה בקובץ המקורי - השורה הגולמית לא נשמרת,
+    ואפשר לשחזר אותה בעזרת attach_raw_lines. בלי offsets נשמרת עמודת Raw_Line.
+    reg_candidates: מסכה לכל שורה - האם יש בה מועמד לרישום (4X או N וספרה); בלעדיה זה נבדק כאן.
+    מוני הפענוח (שורות, רשומות, שורות שנפסלו, ברירות מחדל) נשמרים ב-attrs['parse_counts'].
+    """
+    lines = pd.Series(lines, dtype=object)
+    if reg_candidates is not None:
+        reg_candidates = pd.Series(reg_candidates, dtype=bool)
+    total_lines = len(lines)
+    lines = lines[(lines.str.len() >= 10) & (lines.str.slice(7, 9) == '01')]
+
+    frames = []
+    if layout is not None:
+        fixed, valid = _parse_fixed(lines, layout, reg_candidates)
+        frames.append(fixed.assign(**{'Parse Path': 'fixed'}))
+        lines_left = lines[~valid]
+    else:
+        lines_left = lines
+    heuristic, counts = _parse_heuristic(lines_left, layout.get('amount_index', 0) if layout else 0)
+    frames.append(heuristic.assign(**{'Parse Path': 'heuristic'}))
+    parsed = pd.concat(frames).sort_index() if len(frames) > 1 else frames[0]
+    counts = {'lines': total_lines, 'records': len(lines), 'other_lines': total_lines - len(lines),
+              'fixed': len(frames[0]) if len(frames) > 1 else 0, 'heuristic': len(heuristic), **counts}
+
+    dates = parsed.pop('Dates').str.replace('/', '-', regex=False)
+    parsed.insert(0, 'Date', to_datetime_ns(dates, format='%Y-%m-%d'))
+    if offsets is None:
+        parsed['Raw_Line'] = lines[parsed.index].str.strip()
+    else:
+        offsets = np.asarray(offsets, dtype=np.int64).reshape(-1, 2)
+        parsed['Line_Start'] = offsets[parsed.index, 0]
+        parsed['Line_End'] = offsets[parsed.index, 1]
+    parsed = compact_columns(parsed.reset_index(drop=True))
+    parsed.attrs['parse_counts'] = counts
+    return parsed
+
+# שורת רשומה ארוכה מזה (לא בפורמט הרוחב הקבוע) מפוענחת כמחרוזת בודדת ולא דרך מערך הבתים
+PF_MAX_LINE_BYTES = 512
+# מספר שורות שמועתקות יחד למערך הרוחב הקבוע
+GATHER_BLOCK_LINES = 8192
+
+# מפרידי השורות של str.splitlines: בתים בודדים ('\r\n' נחשב מפריד אחד),
+# ותווי Unicode שמקודדים ב-UTF-8 בכמה בתים (NEL, LINE SEPARATOR, PARAGRAPH SEPARATOR)
+LINE_BREAK_BYTES = np.zeros(256, dtype=bool)
+LINE_BREAK_BYTES[list(b'\n\r\x0b\x0c\x1c\x1d\x1e')] = True
+MULTIBYTE_LINE_BREAKS = ('\x85'.encode(), '\u2028'.encode(), '\u2029'.encode())
+
+def _line_bounds(buf):
+    """מיקומי ההתחלה והסוף (בלי המפריד) של כל שורה במערך הבתים - אותה חלוקה כמו str.splitlines"""
+    # כל המפרידים של בית אחד הם תווי בקרה (עד 0x1e), ולכן טבלת הבדיקה רצה רק עליהם
+    control = np.flatnonzero(buf <= 0x1e)
+    breaks = control[LINE_BREAK_BYTES[buf[control]]]
+    values = buf[breaks]
+    crlf = (values == ord('\r')) & (buf[np.minimum(breaks + 1, len(buf) - 1)] == ord('\n')) & (breaks + 1 < len(buf))
+    # ה-'\n' של '\r\n' שייך למפריד שלפניו
+    lf_of_crlf = (values == ord('\n')) & (breaks > 0) & (buf[np.maximum(breaks - 1, 0)] == ord('\r'))
+    sizes = np.where(crlf, 2, 1)[~lf_of_crlf]
+    breaks = breaks[~lf_of_crlf]
+    lead = np.flatnonzero(buf >= 0xC2)
+    for separator in MULTIBYTE_LINE_BREAKS:
+        found = lead[lead <= len(buf) - len(separator)]
+        for shift, value in enumerate(separator):
+            found = found[buf[found + shift] == value]
+        breaks = np.concatenate((breaks, found))
+        sizes = np.concatenate((sizes, np.full(len(found), len(separator))))
+    order = np.argsort(breaks, kind='stable')
+    breaks, sizes = breaks[order], sizes[order]
+    starts = np.concatenate(([0], breaks + sizes))
+    ends = np.concatenate((breaks, [len(buf)]))
+    if starts[-1] == len(buf):
+        starts, ends = starts[:-1], ends[:-1]
+    return starts, ends
+
+def _record_lines(buf, starts, ends):
+    """מסכה של שורות הרשומה ('01' ב-[7:9]) מתוך גבולות השורות במערך הבתים"""
+    return ((ends - starts >= 10) & (buf[np.minimum(starts + 7, len(buf) - 1)] == ord('0'))
+            & (buf[np.minimum(starts + 8, len(buf) - 1)] == ord('1')))
+
+def parse_eurocontrol_bytes(data, base_offset=0, layout=None):
+    """
+    מפענח תוכן של קובץ PF (או טווח שורות שלמות ממנו) ישירות מהבתים - bytes, mmap או memoryview.
+    גבולות השורות וסינון רשומות '01' נעשים על מערך numpy של הבתים, ורק שורות הרשומה
+    מפוענחות לטקסט (כמערך ברוחב קבוע), כך שלא נוצר עותק Unicode של כל הקובץ.
+    מיקומי השורות נשמרים יחסית לתחילת הקובץ (base_offset = מיקום הטווח בקובץ).
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    starts, ends = _line_bounds(buf)
+    lengths = ends - starts
+
+    # שורה עם תווים שאינם ASCII: מיקום התו שונה ממיקום הבית, ולכן היא מפוענחת כמחרוזת
+    ascii_line = np.ones(len(starts), dtype=bool)
+    high = np.flatnonzero(buf >= 0x80)
+    ascii_line[np.searchsorted(starts, high, side='right') - 1] = False
+    is_record = _record_lines(buf, starts, ends)
+    fixed = np.flatnonzero(ascii_line & is_record & (lengths <= PF_MAX_LINE_BYTES))
+    other = np.flatnonzero(~ascii_line | (is_record & (lengths > PF_MAX_LINE_BYTES)))
+
+    lines = np.empty(len(fixed) + len(other), dtype=object)
+    # שורה שמפוענחת כמחרוזת נבדקת לרישום בחיפוש הרגיל
+    reg_candidates = np.ones(len(lines), dtype=bool)
+    order = np.argsort(np.concatenate((fixed, other)), kind='stable')
+    positions = np.empty_like(order)
+    positions[order] = np.arange(len(order))
+
+    if len(fixed):
+        width = int(lengths[fixed].max())
+        columns = np.arange(width)
+        # מערך אינדקסים של שורות x רוחב נבנה בבלוקים כדי שלא יגדל עם הקובץ
+        for first in range(0, len(fixed), GATHER_BLOCK_LINES):
+            rows = fixed[first:first + GATHER_BLOCK_LINES]
+            index = np.minimum(starts[rows, None] + columns, len(buf) - 1)
+            block = np.where(columns < lengths[rows, None], buf[index], 0).astype(np.uint8)
+            lines[positions[first:first + len(rows)]] = block.view(f'S{width}').ravel().astype(f'U{width}')
+            # מועמד לרישום: '4X', או 'N' ואחריה ספרה
+            head, tail = block[:, :-1], block[:, 1:]
+            has_reg = ((head == ord('4')) & (tail == ord('X'))) | ((head == ord('N')) & (tail >= ord('0')) & (tail <= ord('9')))
+            reg_candidates[positions[first:first + len(rows)]] = has_reg.any(axis=1)
+    lines[positions[len(fixed):]] = [
+        bytes(buf[start:end]).decode('utf-8', errors='ignore') for start, end in zip(starts[other], ends[other])]
+
+    selected = np.concatenate((fixed, other))[order]
+    offsets = np.column_stack([starts[selected], ends[selected]]) + base_offset
+    parsed = parse_eurocontrol_lines(lines, offsets=offsets, layout=layout, reg_candidates=reg_candidates)
+    # שורות שאינן רשומות סוננו כאן כבר ברמת הבתים
+    counts = parsed.attrs['parse_counts']
+    counts['lines'] = len(starts)
+    counts['other_lines'] = len(starts) - counts['records']
+    counts['decoded_per_line'] = len(other)
+    return parsed
+
+def open_pf_file(path):
+    """ממפה קובץ PF לזיכרון (קריאה בלבד) במקום לקרוא אותו - הדפים נטענים מהדיסק לפי הצורך"""
+    with open(path, 'rb') as pf_file:
+        if os.fstat(pf_file.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(pf_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def close_pf_files(files):
+    """סוגר את המיפויים שנפתחו ב-open_pf_file (files: זוגות שם ותוכן; תוכן שאינו mmap לא נסגר)"""
+    for _, data in files:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+def attach_raw_lines(df, buffers):
+    """
+    משחזר את Raw_Line (השורה המקורית) מתוך תוכן הקבצים - רק לשורות ב-df,
+    למשל השורות שלא הותאמו. buffers: שם קובץ -> bytes.
+    """
+    raw = pd.Series('', index=df.index, dtype=object)
+    for name, rows in df.groupby('Source File', observed=True).groups.items():
+        data = buffers[name]
+        spans = df.loc[rows, ['Line_Start', 'Line_End']].to_numpy()
+        raw[rows] = [data[start:end].decode('utf-8', errors='ignore').strip() for start, end in spans]
+    df['Raw_Line'] = raw
+    return df
+
+def _add_file_columns(parsed, name, invoice_ref, charge_type):
+    """עמודות ברמת הקובץ (זהות בכל השורות, ולכן category)"""
+    parsed['Charge Type'] = pd.Categorical([charge_type] * len(parsed))
+    parsed['Invoice No'] = pd.Categorical([invoice_ref] * len(parsed))
+    parsed['Source File'] = pd.Categorical([name] * len(parsed))
+    return parsed
+
+# גודל מקטע (בבתים) בפענוח זורם של קבצים שכבר בזיכרון או ממופים
+EURO_CHUNK_BYTES = 4 * 1024 * 1024
+
+def iter_eurocontrol_buffers(files, chunk_bytes=EURO_CHUNK_BYTES):
+    """
+    קורא ומפענח את קבצי ה-PF בהדרגה, ישירות על תוכן הקבצים (bytes או mmap) בלי להעתיק אותו:
+    כל קובץ מפוענח בטווחים של שורות שלמות. files הוא רשימת זוגות (שם קובץ, תוכן).
+    """
+    for name, data in files:
+        invoice_ref = extract_invoice_reference(_header_text(data))
+        charge_type, layout = detect_layout(name, data)
+        view = memoryview(data)
+        for start, end in _split_line_ranges(data, chunk_bytes):
+            parsed = parse_eurocontrol_bytes(view[start:end], base_offset=start, layout=layout)
+            yield _add_file_columns(parsed, name, invoice_ref, charge_type)
+
+# גודל מקסימלי (בבתים) של טווח שורות שנשלח לתהליך עבודה אחד
+PARALLEL_SPLIT_BYTES = 8 * 1024 * 1024
+
+def _header_text(data):
+    """מחזיר את שלוש שורות הכותרת הראשונות של הקובץ כטקסט"""
+    sample = bytes(data[:LAYOUT_SAMPLE_BYTES]).decode('utf-8', errors='ignore')
+    return '\n'.join(sample.splitlines()[:3])
+
+# גודל החלון שבו מחפשים את סוף השורה בנקודת חלוקה
+LINE_SEARCH_BYTES = 64 * 1024
+
+def _next_line_start(data, position):
+    """מיקום תחילת השורה הבאה אחרי position (אחרי מפריד השורה הראשון שמופיע ממנו והלאה)"""
+    while position < len(data):
+        window = np.frombuffer(data[position:position + LINE_SEARCH_BYTES], dtype=np.uint8)
+        control = np.flatnonzero(window <= 0x1e)
+        found = control[LINE_BREAK_BYTES[window[control]]]
+        if len(found):
+            end = position + int(found[0]) + 1
+            if data[end - 1:end] == b'\r' and data[end:end + 1] == b'\n':
+                end += 1
+            return end
+        position += len(window)
+    return len(data)
+
+def _split_line_ranges(data, split_bytes):
+    """
+    מחלק את תוכן הקובץ לטווחים של שורות שלמות (התחלה, סוף), כל טווח בערך split_bytes בתים.
+    החלוקה היא רק אחרי מפריד שורה של בית אחד, ולכן לא חוצה שורה או תו.
+    """
+    if not len(data):
+        yield 0, 0
+        return
+    start = 0
+    while start < len(data):
+        end = _next_line_start(data, start + split_bytes)
+        yield start, end
+        start = end
+
+def _file_tasks(files, split_bytes, copy):
+    """
+    משימות הפענוח (טווחי שורות) של הקבצים, שנבנות רק כשמגיע תורן. בלי copy הטווח הוא memoryview
+    על תוכן הקובץ (בלי העתקה), ועם copy הוא bytes שאפשר לשלוח לתהליך עבודה.
+    """
+    for index, (name, data) in enumerate(files):
+        invoice_ref = extract_invoice_reference(_header_text(data))
+        detected = detect_layout(name, data)
+        view = memoryview(data)
+        for start, end in _split_line_ranges(data, split_bytes):
+            part = bytes(view[start:end]) if copy else view[start:end]
+            yield index, name, invoice_ref, detected, (start, part)
+
+def _parse_file_part(task):
+    """פונקציית העבודה של התהליך: מפענחת טווח שורות אחד של קובץ. מחזירה (מספר הקובץ, DataFrame)"""
+    index, name, invoice_ref, (charge_type, layout), (offset, data) = task
+    parsed = parse_eurocontrol_bytes(data, base_offset=offset, layout=layout)
+    return index, _add_file_columns(parsed, name, invoice_ref, charge_type)
+
+# מספר טווחי השורות שנשלחים מראש לכל תהליך עבודה - רק הם מועתקים לזיכרון בכל רגע
+PARALLEL_TASKS_PER_WORKER = 2
+
+def _bounded_map(pool, fn, tasks, in_flight):
+    """כמו pool.map לפי הסדר, אבל משימה נבנית ונשלחת רק כשיש פחות מ-in_flight משימות פתוחות"""
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(fn, task))
+        if len(pending) >= in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def iter_eurocontrol_parts(files, workers=None, split_bytes=PARALLEL_SPLIT_BYTES):
+    """
+    מפענח קבצים רבים (או טווחי שורות של קבצים גדולים) במקביל על כמה ליבות.
+    files הוא רשימת זוגות (שם קובץ, bytes או mmap). מוחזר (מספר הקובץ, DataFrame) לכל טווח שורות,
+    לפי הסדר, ולכל קובץ לפחות טווח אחד. הטווחים מועתקים לתהליכי העבודה בהדרגה,
+    כך שבכל רגע רק מספר קבוע מהם בזיכרון.
+    """
+    files = list(files)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or (len(files) <= 1 and all(len(data) <= split_bytes for _, data in files)):
+        yield from map(_parse_file_part, _file_tasks(files, split_bytes, copy=False))
+        return
+
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=worker_context())
+    try:
+        tasks = _file_tasks(files, split_bytes, copy=True)
+        yield from _bounded_map(pool, _parse_file_part, tasks, workers * PARALLEL_TASKS_PER_WORKER)
+    finally:
+        # צרכן שהפסיק באמצע לא מחכה לפענוח הקבצים שעוד לא התחילו
+        pool.shutdown(cancel_futures=True)
+
+def iter_eurocontrol_parallel(files, workers=None, split_bytes=PARALLEL_SPLIT_BYTES):
+    """כמו iter_eurocontrol_parts, אבל מחזיר רק את מקטעי ה-DataFrame (עד split_bytes בתים של קלט כל אחד)"""
+    parts = iter_eurocontrol_parts(files, workers=workers, split_bytes=split_bytes)
+    try:
+        for _, parsed in parts:
+            yield parsed
+    finally:
+        parts.close()
+
+def worker_context():
+    """
+    forkserver (כשזמין) במקום fork: הפענוח רץ ב-thread לצד טעינת לאון וה-threads של Streamlit,
+    ו-fork מתהליך עם threads פעילים עלול להעתיק נעילה תפוסה לתהליך העבודה.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return None
+
+def sum_parse_counts(frames):
+    """מסכם את מוני הפענוח של כמה מקטעים"""
+    total = {}
+    for frame in frames:
+        for name, value in frame.attrs.get('parse_counts', {}).items():
+            total[name] = total.get(name, 0) + value
+    return total
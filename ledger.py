@@ -0,0 +1,187 @@
+"""
+יומן התאמות מצטבר (SQLite) בין מחזורי חשבוניות.
+כל שורת חיוב נשמרת לפי (Invoice No, hash של השורה הגולמית) יחד עם תוצאת ההתאמה,
+כך שבהעלאה חוזרת רק שורות חדשות (או שעדיין לא הותאמו) עוברות התאמה.
+"""
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from matching import match_flights
+
+DEFAULT_LEDGER_PATH = os.environ.get(
+    'AUDITOR_LEDGER', os.path.join(os.path.expanduser('~'), '.aviation-auditor', 'ledger.sqlite3'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS charges (
+    invoice_no TEXT NOT NULL,
+    line_hash INTEGER NOT NULL,
+    charge_key INTEGER NOT NULL,
+    source_file TEXT,
+    flight_date TEXT,
+    reg TEXT,
+    dep TEXT,
+    arr TEXT,
+    amount REAL,
+    leon_trip,
+    matched TEXT,
+    match_method TEXT,
+    match_confidence REAL,
+    leon_hash TEXT,
+    fuzzy INTEGER,
+    PRIMARY KEY (invoice_no, line_hash)
+);
+CREATE INDEX IF NOT EXISTS charges_charge_key ON charges (charge_key);
+"""
+# עמודות שנוספו אחרי הגרסה הראשונה של היומן -> הגדרת העמודה (ביומן קיים הן נוספות ב-ALTER TABLE)
+ADDED_COLUMNS = {
+    'leon_hash': 'TEXT',
+    'fuzzy': 'INTEGER',
+}
+
+# עמודות התוצאה ביומן -> העמודות ב-DataFrame
+RESULT_COLUMNS = {
+    'leon_trip': 'Leon Trip Number',
+    'matched': 'Matched?',
+    'match_method': 'Match Method',
+    'match_confidence': 'Match Confidence',
+}
+
+def _hash_values(values):
+    """
+    hash וקטורי של 64 ביט (כמספר שלם עם סימן, כפי ש-SQLite שומר).
+    ההמרה ל-object נותנת אותו hash בין אם המקטע פוענח עכשיו ובין אם נטען מהמטמון.
+    """
+    return pd.util.hash_pandas_object(values.astype(object), index=False).to_numpy().view(np.int64)
+
+def _charge_fields(chunk):
+    """שדות החיוב בצורה קנונית (תאריך כמחרוזת, סכום ביורו) - ה-hash לא תלוי בסוגי העמודות"""
+    return pd.DataFrame({
+        'Date': chunk['Date'].dt.strftime('%Y-%m-%d'),
+        'Callsign': chunk['Callsign'].astype(object),
+        'Dep': chunk['Dep'].astype(object),
+        'Arr': chunk['Arr'].astype(object),
+        'Amount': chunk['Amount_Cents'] / 100,
+    })
+
+def _sql_rows(df):
+    """ערכי פייתון (None במקום NaN) להכנסה ל-SQLite"""
+    df = df.astype(object)
+    return list(df.where(df.notna(), None).itertuples(index=False, name=None))
+
+
+class Ledger:
+    """
+    charge_key הוא hash של (תאריך, זהות, מוצא, יעד, סכום) - אותו חיוב שמופיע בחשבונית
+    אחרת (גם אם מספור השורה שונה) נמצא דרך האינדקס עליו, בלי סריקה של כל היומן.
+    תוצאה נשמרת עם ה-hash של דוח לאון ועם fuzzy, ומוגשת שוב רק מול אותו דוח ואותן אפשרויות.
+    """
+
+    def __init__(self, path=DEFAULT_LEDGER_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(charges)")}
+        with self._conn:
+            for column, definition in ADDED_COLUMNS.items():
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE charges ADD COLUMN {column} {definition}")
+        self._conn.execute(
+            "CREATE TEMP TABLE probe (pos INTEGER, invoice_no TEXT, line_hash INTEGER, charge_key INTEGER)")
+
+    def reconcile(self, chunk, leon_index, fuzzy=True, claimed=None):
+        """
+        מחזיר את המקטע עם עמודות ההתאמה (המקטע צריך לכלול Raw_Line). שורות שכבר הותאמו בעבר מקבלות את התוצאה מהיומן,
+        והשאר מותאמות עכשיו ונשמרות. עמודת From Ledger מסמנת שורות שהוגשו מהיומן.
+        leon_index צריך source_hash (ה-hash של דוח לאון), כי תוצאה מדוח אחר אינה תקפה.
+        claimed (set) - הטיולים שכבר הותאמו בביקורת, כמו ב-match_flights; הטיולים מהיומן נוספים אליו.
+        """
+        claimed = set() if claimed is None else claimed
+        if leon_index.source_hash is None:
+            raise ValueError("The ledger needs the Leon report hash (LeonIndex source_hash).")
+        chunk = chunk.reset_index(drop=True)
+        line_hash = _hash_values(chunk['Raw_Line'])
+        charge_key = _hash_values(_charge_fields(chunk))
+        probe = list(zip(range(len(chunk)), chunk['Invoice No'].astype(str), line_hash.tolist(), charge_key.tolist()))
+
+        with self._lock:
+            self._conn.execute("DELETE FROM probe")
+            self._conn.executemany("INSERT INTO probe VALUES (?, ?, ?, ?)", probe)
+            known = pd.read_sql_query(
+                "SELECT p.pos, " + ", ".join(RESULT_COLUMNS) + " FROM probe p "
+                "JOIN charges c ON c.invoice_no = p.invoice_no AND c.line_hash = p.line_hash "
+                "WHERE c.matched = 'YES' AND c.leon_hash = ? AND c.fuzzy = ?", self._conn,
+                params=(leon_index.source_hash, int(fuzzy))).drop_duplicates('pos')
+
+        from_ledger = np.zeros(len(chunk), dtype=bool)
+        from_ledger[known['pos'].to_numpy(dtype=np.int64)] = True
+
+        served = chunk[from_ledger].copy()
+        for column, target in RESULT_COLUMNS.items():
+            served[target] = known.set_index('pos')[column].reindex(served.index).to_numpy()
+        claimed.update(served['Leon Trip Number'].dropna())
+        pending = chunk[~from_ledger].copy()
+        if len(pending):
+            pending = match_flights(pending, leon_index, fuzzy=fuzzy, claimed=claimed)
+
+        result = pd.concat([pending, served]).sort_index()
+        result['From Ledger'] = from_ledger
+
+        self._store(pending, line_hash[~from_ledger], charge_key[~from_ledger], leon_index.source_hash, fuzzy)
+        return result
+
+    def _store(self, matched, line_hash, charge_key, leon_hash, fuzzy):
+        if not len(matched):
+            return
+        rows = pd.DataFrame({
+            'invoice_no': matched['Invoice No'].astype(str).to_numpy(),
+            'line_hash': line_hash,
+            'charge_key': charge_key,
+            'source_file': matched['Source File'].astype(object).to_numpy(),
+            'flight_date': matched['Date'].dt.strftime('%Y-%m-%d').to_numpy(),
+            'reg': matched['Reg'].astype(object).to_numpy(),
+            'dep': matched['Dep'].astype(object).to_numpy(),
+            'arr': matched['Arr'].astype(object).to_numpy(),
+            'amount': (matched['Amount_Cents'] / 100).to_numpy(),
+            **{column: matched[target].to_numpy() for column, target in RESULT_COLUMNS.items()},
+            'leon_hash': leon_hash,
+            'fuzzy': int(fuzzy),
+        })
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO charges ({', '.join(rows.columns)}) "
+                f"VALUES ({', '.join('?' * len(rows.columns))})", _sql_rows(rows))
+
+    def duplicates(self, invoices=None):
+        """
+        חיובים שמופיעים ביותר מחשבונית אחת (לפי charge_key).
+        אם invoices נמסר - רק כפילויות של חיובים מהחשבוניות האלה מול כל חשבונית אחרת.
+        """
+        query = (
+            "SELECT a.invoice_no AS 'Invoice No', a.source_file AS 'Source File', "
+            "b.invoice_no AS 'Also In Invoice', b.source_file AS 'Also In File', "
+            "a.flight_date AS 'Date', a.reg AS 'Reg', a.dep AS 'Dep', a.arr AS 'Arr', a.amount AS 'Amount' "
+            "FROM charges a JOIN charges b ON a.charge_key = b.charge_key "
+        )
+        params = []
+        if invoices is None:
+            query += "AND a.invoice_no < b.invoice_no"
+        else:
+            invoices = sorted(set(map(str, invoices)))
+            # זוג שבו שתי החשבוניות ברשימה מוחזר פעם אחת בלבד
+            marks = ', '.join('?' * len(invoices))
+            query += (f"AND a.invoice_no <> b.invoice_no WHERE a.invoice_no IN ({marks}) "
+                      f"AND (b.invoice_no NOT IN ({marks}) OR a.invoice_no < b.invoice_no)")
+            params = invoices + invoices
+        with self._lock:
+            return pd.read_sql_query(query, self._conn, params=params)
+
+    def close(self):
+        self._conn.close()
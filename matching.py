@@ -0,0 +1,176 @@
+"""
+טעינת דוח לאון ומנוע ההתאמה בין שורות החשבונית לטיסות לאון.
+"""
+import io
+
+import numpy as np
+import pandas as pd
+
+from eurocontrol import to_datetime_ns
+
+
+def load_leon_report(data, name):
+    """קורא את דוח לאון (bytes) ומנרמל את העמודות הדרושות להתאמה"""
+    if name.endswith('.csv'):
+        try:
+            leon_df = pd.read_csv(io.BytesIO(data))
+        except UnicodeDecodeError:
+            leon_df = pd.read_csv(io.BytesIO(data), encoding='latin1')
+    else:
+        leon_df = pd.read_excel(io.BytesIO(data))
+
+    leon_df.columns = [c.split('[')[0].strip() for c in leon_df.columns]
+    leon_df['Date ADEP'] = to_datetime_ns(leon_df['Date ADEP'], dayfirst=True).dt.normalize()
+
+    if 'Aircraft' not in leon_df.columns:
+        raise ValueError("Missing 'Aircraft' column in Leon file.")
+    leon_df['Aircraft_Clean'] = leon_df['Aircraft'].astype(str).str.replace('-', '').str.replace(' ', '')
+
+    if 'Flight number' in leon_df.columns:
+        leon_df['Flight_Clean'] = leon_df['Flight number'].astype(str).str.strip()
+    else:
+        leon_df['Flight_Clean'] = ''
+    return leon_df
+
+# שכבות ההתאמה לפי סדר עדיפות: שם השיטה -> (עמודת הזהות ביורוקונטרול, עמודת הזהות בלאון)
+MATCH_TIERS = {
+    'Registration': ('Reg', 'Aircraft_Clean'),
+    'Flight Number': ('Callsign', 'Flight_Clean'),
+}
+
+# שכבות התאמה סלחניות (רק לשורות שלא הותאמו במדויק): שם השיטה ->
+# (עמודות יורוקונטרול, עמודות לאון, ציון ביטחון בסיסי). התאריך מותר בסטייה של יום.
+FUZZY_TIERS = {
+    'Fuzzy: Date ±1 day': (['Reg_Norm', 'Dep', 'Arr'], ['Reg_Norm', 'ADEP ICAO', 'ADES ICAO'], 0.9),
+    'Fuzzy: Diverted arrival': (['Reg_Norm', 'Dep'], ['Reg_Norm', 'ADEP ICAO'], 0.6),
+}
+FUZZY_DATE_TOLERANCE = pd.Timedelta(days=1)
+# הפחתת הביטחון לכל יום של סטייה בתאריך
+FUZZY_DAY_PENALTY = 0.15
+# התאמה בביטחון נמוך מזה מסומנת REVIEW ולא YES - היא נשארת ברשימת הבדיקה (לא הותאמו)
+MATCH_MIN_CONFIDENCE = 0.75
+
+def normalize_registration(values):
+    """רישום בלי מקפים, רווחים ואותיות קטנות (4x-abc -> 4XABC)"""
+    return values.astype(str).str.upper().str.replace(r'[^A-Z0-9]', '', regex=True)
+
+class LeonIndex:
+    """
+    אינדקס מפתחות מורכבים (תאריך, זהות, מוצא, יעד) של לאון לכל שכבת התאמה.
+    המפתחות נשמרים כ-MultiIndex - כלומר מקודדים כמספרים שלמים לכל רמה - כך
+    שההתאמה היא חיפוש hash וקטורי אחד ולא שרשור מחרוזות ומילון פייתון.
+    source_hash מזהה את דוח לאון שממנו נבנה האינדקס (נדרש ליומן ההתאמות).
+    """
+
+    def __init__(self, leon_df, source_hash=None):
+        self.source_hash = source_hash
+        self.keys = {}
+        self.trips = {}
+        duplicates = []
+        for method, (_, leon_col) in MATCH_TIERS.items():
+            key_columns = ['Date ADEP', leon_col, 'ADEP ICAO', 'ADES ICAO']
+            # שורת לאון בלי מספר טיול אינה התאמה (אחרת "YES" בלי טיול) - לא נכנסת לאינדקס
+            leon_keys = leon_df[key_columns + ['Trip number']].dropna()
+            keys = pd.MultiIndex.from_frame(leon_keys[key_columns])
+
+            # מפתח כפול בלאון - נשמר האחרון (כמו to_dict בעבר), אבל מדווח
+            is_dup = keys.duplicated(keep=False)
+            if is_dup.any():
+                dup = leon_keys[is_dup].rename(columns={leon_col: 'Identity'})
+                dup.insert(0, 'Match Method', method)
+                duplicates.append(dup)
+
+            keep = ~keys.duplicated(keep='last')
+            self.keys[method] = keys[keep]
+            self.trips[method] = leon_keys['Trip number'].to_numpy()[keep]
+
+        self.duplicates = pd.concat(duplicates, ignore_index=True) if duplicates else pd.DataFrame(
+            columns=['Match Method', 'Date ADEP', 'Identity', 'ADEP ICAO', 'ADES ICAO', 'Trip number'])
+
+        # אינדקס ממוין לפי תאריך לשכבות הסלחניות (חיפוש merge_asof בחלון תאריכים)
+        fuzzy = pd.DataFrame({
+            'Flight Date': leon_df['Date ADEP'],
+            'Reg_Norm': normalize_registration(leon_df['Aircraft_Clean']),
+            'ADEP ICAO': leon_df['ADEP ICAO'],
+            'ADES ICAO': leon_df['ADES ICAO'],
+            'Trip number': leon_df['Trip number'],
+        }).dropna(subset=['Flight Date', 'ADEP ICAO', 'ADES ICAO', 'Trip number'])
+        fuzzy[['ADEP ICAO', 'ADES ICAO']] = fuzzy[['ADEP ICAO', 'ADES ICAO']].astype(str)
+        fuzzy['Leon Date'] = fuzzy['Flight Date']
+        self.fuzzy = fuzzy.sort_values('Flight Date', kind='stable').reset_index(drop=True)
+
+    def lookup(self, euro_df, method):
+        """מחזיר לכל שורה את מיקום הטיסה התואמת באינדקס (או -1)"""
+        euro_col = MATCH_TIERS[method][0]
+        probe = pd.MultiIndex.from_arrays([euro_df['Date'], euro_df[euro_col], euro_df['Dep'], euro_df['Arr']])
+        return self.keys[method].get_indexer(probe)
+
+    def fuzzy_lookup(self, euro_df, method, claimed=()):
+        """
+        מחפש לכל שורה את טיסת לאון הקרובה ביותר בתאריך (עד יום לכל כיוון) עם אותם ערכים
+        בעמודות השכבה, מבין הטיולים שאינם ב-claimed (כבר הותאמו). כל טיול מותאם לשורה אחת בלבד -
+        הקרובה ביותר בתאריך. מחזיר DataFrame לפי מספר השורה ב-euro_df: Trip number ו-Days Off.
+        """
+        euro_cols, leon_cols, _ = FUZZY_TIERS[method]
+        candidates = self.fuzzy
+        if claimed:
+            candidates = candidates[~candidates['Trip number'].isin(list(claimed))]
+        probe = pd.DataFrame({
+            'Row': np.arange(len(euro_df)),
+            'Flight Date': euro_df['Date'].to_numpy(),
+            'Reg_Norm': normalize_registration(euro_df['Reg']).to_numpy(),
+            'Dep': euro_df['Dep'].astype(str).to_numpy(),
+            'Arr': euro_df['Arr'].astype(str).to_numpy(),
+        }).dropna(subset=['Flight Date']).sort_values('Flight Date', kind='stable')
+
+        found = pd.merge_asof(
+            probe, candidates[['Flight Date', 'Leon Date', 'Trip number'] + leon_cols],
+            on='Flight Date', left_by=euro_cols, right_by=leon_cols,
+            tolerance=FUZZY_DATE_TOLERANCE, direction='nearest',
+        ).dropna(subset=['Leon Date'])
+        found['Days Off'] = (found['Leon Date'] - found['Flight Date']).dt.days
+        found = found.assign(Distance=found['Days Off'].abs()).sort_values(['Distance', 'Row'], kind='stable')
+        found = found.drop_duplicates('Trip number').sort_values('Row')
+        return found.set_index('Row')[['Trip number', 'Days Off']]
+
+def match_flights(euro_df, leon_index, fuzzy=True, claimed=None):
+    """
+    מתאים מקטע של שורות חשבונית מול לאון במעבר אחד ומוסיף את עמודות התוצאה.
+    אחרי השכבות המדויקות (ביטחון 1.0) מנסה את השכבות הסלחניות, אם fuzzy מופעל - רק מול טיולים
+    שלא הותאמו עדיין. claimed (set) הוא הטיולים שכבר הותאמו במקטעים קודמים של אותה ביקורת,
+    והוא מתעדכן כאן. התאמה בביטחון מתחת ל-MATCH_MIN_CONFIDENCE מסומנת REVIEW.
+    """
+    claimed = set() if claimed is None else claimed
+    trip = pd.Series(np.nan, index=euro_df.index, dtype=object)
+    method = np.full(len(euro_df), '-', dtype=object)
+    confidence = np.full(len(euro_df), np.nan)
+    for tier in MATCH_TIERS:
+        pending = method == '-'
+        if not pending.any():
+            break
+        positions = leon_index.lookup(euro_df[pending], tier)
+        found = positions >= 0
+        rows = np.flatnonzero(pending)[found]
+        trip.iloc[rows] = leon_index.trips[tier][positions[found]]
+        method[rows] = tier
+        confidence[rows] = 1.0
+    claimed.update(trip.dropna())
+
+    fuzzy_tiers = FUZZY_TIERS.items() if fuzzy else []
+    for tier, (_, _, base_confidence) in fuzzy_tiers:
+        pending = method == '-'
+        if not pending.any():
+            break
+        found = leon_index.fuzzy_lookup(euro_df[pending], tier, claimed)
+        rows = np.flatnonzero(pending)[found.index.to_numpy()]
+        trip.iloc[rows] = found['Trip number'].to_numpy()
+        method[rows] = tier
+        confidence[rows] = base_confidence - FUZZY_DAY_PENALTY * found['Days Off'].abs().to_numpy()
+        claimed.update(found['Trip number'])
+
+    confidence = confidence.round(2)
+    euro_df['Leon Trip Number'] = trip.infer_objects()
+    euro_df['Matched?'] = np.select([confidence >= MATCH_MIN_CONFIDENCE, method != '-'], ['YES', 'REVIEW'], 'NO')
+    euro_df['Match Method'] = method
+    euro_df['Match Confidence'] = confidence
+    return euro_df
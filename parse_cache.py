@@ -0,0 +1,184 @@
+"""
+מטמון בדיסק של קבצי PF מפוענחים, לפי תוכן הקובץ.
+המפתח הוא hash של ה-bytes יחד עם PARSER_VERSION, והתוצאה נשמרת כ-Parquet.
+"""
+import hashlib
+import itertools
+import json
+import os
+import threading
+from collections import Counter
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from eurocontrol import PARSER_VERSION, compact_columns, detect_charge_type, iter_eurocontrol_parts
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'AUDITOR_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'aviation-auditor', 'parsed'))
+DEFAULT_CACHE_MB = int(os.environ.get('AUDITOR_CACHE_MB', 512))
+# גרסת מבנה הקובץ השמור (מוני הפענוח במטא-דאטה של ה-Parquet); חלק מהמפתח
+CACHE_FORMAT = '2'
+# מספר השורות בכל מקטע שנקרא מקובץ שמור (בערך כמו מקטע של פענוח זורם)
+CACHE_READ_ROWS = 50_000
+
+
+class ParseCache:
+    """
+    מטמון LRU מוגבל בגודל. זמן הגישה האחרון נשמר ב-mtime של הקובץ,
+    וכשהמטמון עובר את max_bytes נמחקים הקבצים שנגעו בהם לפני הכי הרבה זמן.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._remove_stale_versions()
+
+    def key(self, data, charge_type=''):
+        """הפריסה נקבעת גם לפי סוג החיוב (משם הקובץ), ולכן הוא חלק מהמפתח"""
+        digest = hashlib.sha256(f"{PARSER_VERSION}\0{CACHE_FORMAT}\0{charge_type}\0".encode())
+        digest.update(data)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"v{PARSER_VERSION}-{key}.parquet")
+
+    def contains(self, key):
+        """בדיקה זולה אם יש קובץ שמור - בלי לקרוא אותו"""
+        return os.path.exists(self._path(key))
+
+    def open(self, key):
+        """פותח את הקובץ השמור לקריאה במקטעים (pyarrow ParquetFile), או None אם אינו קיים או פגום"""
+        path = self._path(key)
+        try:
+            reader = pq.ParquetFile(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self.hits += 1
+        return reader
+
+    def put_chunks(self, key, frames):
+        """
+        מעביר הלאה את מקטעי הפענוח של קובץ ותוך כדי כותב אותם לקובץ זמני.
+        הקובץ נכנס למטמון רק אחרי שכל המקטעים עברו; צרכן שעצר באמצע לא משאיר קובץ חלקי.
+        """
+        with self._lock:
+            self.misses += 1
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        writer, counts = None, Counter()
+        try:
+            for frame in frames:
+                table = _to_table(frame.drop(columns=['Source File']), writer.schema if writer else None)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, table.schema)
+                writer.write_table(table)
+                counts.update(frame.attrs.get('parse_counts', {}))
+                yield frame
+            writer.add_key_value_metadata({'parse_counts': json.dumps({name: int(value) for name, value in counts.items()})})
+            writer.close()
+        except BaseException:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def clear(self):
+        """פוסל את כל המטמון (למשל אחרי שינוי בכללי הפענוח)"""
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.parquet'):
+                os.remove(entry.path)
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'files': len(entries),
+            'bytes': sum(entry.stat().st_size for entry in entries),
+        }
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith('.parquet')]
+
+    def _remove_stale_versions(self):
+        prefix = f"v{PARSER_VERSION}-"
+        for entry in self._entries():
+            if not entry.name.startswith(prefix):
+                os.remove(entry.path)
+
+    def _evict(self):
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+            total = sum(entry.stat().st_size for entry in entries)
+            for entry in entries:
+                if total <= self.max_bytes:
+                    break
+                total -= entry.stat().st_size
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+def _to_table(frame, schema=None):
+    """
+    טבלת arrow עם סכמה קבועה לכל המקטעים של קובץ: עמודות category נשמרות כמחרוזות
+    (המילון שונה בין מקטעים) וחוזרות ל-category בקריאה.
+    """
+    if schema is None:
+        schema = pa.schema([(column, pa.string() if not pd.api.types.is_numeric_dtype(dtype)
+                             and not pd.api.types.is_datetime64_any_dtype(dtype) else pa.from_numpy_dtype(dtype))
+                            for column, dtype in frame.dtypes.items()])
+    categories = [column for column, dtype in frame.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    return pa.Table.from_pandas(frame.astype(dict.fromkeys(categories, object)), schema=schema, preserve_index=False)
+
+def _read_chunks(reader, name):
+    """קורא קובץ שמור במקטעים של עד CACHE_READ_ROWS שורות; מוני הפענוח של הקובץ מוצמדים למקטע הראשון"""
+    counts = json.loads(reader.metadata.metadata.get(b'parse_counts', b'{}'))
+    batches = reader.iter_batches(batch_size=CACHE_READ_ROWS) if reader.metadata.num_rows else [reader.schema_arrow.empty_table()]
+    for batch in batches:
+        chunk = compact_columns(batch.to_pandas())
+        chunk['Source File'] = pd.Categorical([name] * len(chunk))
+        chunk.attrs['parse_counts'], counts = counts, {}
+        yield chunk
+
+def iter_eurocontrol_cached(files, cache, workers=None):
+    """
+    כמו iter_eurocontrol_parallel, אבל קבצים שכבר פוענחו נקראים מהמטמון (במקטעים, רק כשמגיע תורם)
+    ורק הקבצים החדשים או ששונו מפוענחים (ונשמרים למטמון תוך כדי).
+    """
+    files = list(files)
+    keys = [cache.key(data, detect_charge_type(name)) for name, data in files]
+    cached = [cache.contains(key) for key in keys]
+
+    misses = [file for file, hit in zip(files, cached) if not hit]
+    parts = iter_eurocontrol_parts(misses, workers=workers)
+    # לכל קובץ לפחות טווח אחד, ולכן קבוצה אחת לכל קובץ חסר, לפי הסדר
+    groups = itertools.groupby(parts, key=lambda item: item[0])
+
+    try:
+        for (name, data), key, hit in zip(files, keys, cached):
+            # קובץ שתוכנן כחסר מפוענח תמיד (גם אם קובץ זהה נשמר בינתיים), כדי לא לשבש את סדר הקבוצות
+            reader = cache.open(key) if hit else None
+            if reader is not None:
+                yield from _read_chunks(reader, name)
+                continue
+            if hit:
+                # קובץ שמור שנמחק או נפגם בינתיים - מפוענח כאן, בלי לשבש את סדר הקבצים החסרים
+                frames = (parsed for _, parsed in iter_eurocontrol_parts([(name, data)], workers=1))
+            else:
+                frames = (parsed for _, parsed in next(groups)[1])
+            yield from cache.put_chunks(key, frames)
+    finally:
+        parts.close()
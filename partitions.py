@@ -0,0 +1,251 @@
+"""
+התאמה מחולקת לפי תאריך (מחיצות) לארכיונים של כמה שנים.
+שורות החשבונית נכתבות לקבצים זמניים לפי חודש הטיסה, ולאון נחתך לאותו חודש עם שוליים של
+חלון ההתאמה הסלחנית, כך שכל מחיצה מותאמת בנפרד מול אינדקס קטן ונכתבת לתיקייה משלה.
+הרצה חוזרת של חודש אחד (--partitions) מחליפה רק את הקבצים של אותו חודש.
+
+    python partitions.py --euro PF_DIR --leon leon_report.xlsx --out-dir audit_partitions [--partitions 2024-03]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+from auditor import collect_pf_files, iter_euro_source, run_audit
+from eurocontrol import (PARALLEL_TASKS_PER_WORKER, _bounded_map, attach_raw_lines, close_pf_files, compact_columns,
+                         open_pf_file, worker_context)
+from matching import FUZZY_DATE_TOLERANCE, LeonIndex, load_leon_report
+from parse_cache import ParseCache
+from profiling import StageProfile
+
+# גודל המחיצה: שם -> תדירות Period של pandas (שם המחיצה הוא ה-Period כמחרוזת, למשל 2024-03)
+PARTITION_FREQS = {'month': 'M', 'quarter': 'Q', 'day': 'D'}
+# שורות בלי תאריך טיסה (אין להן התאמה אפשרית) נאספות למחיצה נפרדת
+UNDATED = 'undated'
+
+def partition_names(dates, freq='M'):
+    """שם המחיצה לכל תאריך"""
+    return dates.dt.to_period(freq).astype(str).where(dates.notna(), UNDATED)
+
+def partition_bounds(name, freq='M'):
+    """טווח התאריכים (כולל) של לאון למחיצה: תקופת המחיצה ועוד חלון ההתאמה הסלחנית לכל כיוון"""
+    period = pd.Period(name, freq=freq)
+    return period.start_time - FUZZY_DATE_TOLERANCE, period.end_time.normalize() + FUZZY_DATE_TOLERANCE
+
+def stage_charges(euro_chunks, directory, freq='M', partitions=None, buffers=None, profile=None):
+    """
+    כותב את שורות החשבונית לקבצי Parquet זמניים לפי מחיצה, מקטע אחרי מקטע, כך שרק מקטע אחד בזיכרון.
+    השורה הגולמית מצורפת כאן (buffers: שם קובץ -> bytes), כי ההתאמה עצמה עשויה לרוץ בתהליך אחר.
+    partitions מגביל לרשימת מחיצות. מחזיר מילון מחיצה -> רשימת הקבצים.
+    """
+    profile = profile if profile is not None else StageProfile()
+    staged = {}
+    for chunk in profile.iterate('parse', euro_chunks):
+        profile.count(chunk.attrs.pop('parse_counts', {}))
+        with profile.stage('stage') as measured:
+            names = partition_names(chunk['Date'], freq)
+            if partitions is not None:
+                keep = names.isin(partitions).to_numpy()
+                chunk, names = chunk[keep], names[keep]
+            if buffers is not None:
+                chunk = attach_raw_lines(chunk.copy(), buffers)
+            for name, part in chunk.groupby(names.to_numpy(), sort=False):
+                paths = staged.setdefault(name, [])
+                path = os.path.join(directory, f"{name}-{len(paths):05d}.parquet")
+                part.to_parquet(path, index=False)
+                paths.append(path)
+            measured['rows'] = len(chunk)
+    return staged
+
+def _replace_file(path, write):
+    """כותב לקובץ זמני ומחליף בבת אחת, כך שקורא לא רואה מחיצה כתובה למחצה"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def reconcile_partition(task):
+    """
+    מתאים מחיצה אחת וכותב לתיקייה שלה results.parquet, unmatched.parquet ו-summary.json (אחרון).
+    task הוא (שם, קבצי החיובים, שורות לאון של המחיצה, תיקיית הפלט, fuzzy, hash של דוח לאון).
+    הסיכום (שמוחזר) שומר גם את fuzzy ואת ה-hash של לאון, כדי לזהות מחיצות שהותאמו באפשרויות שונות.
+    """
+    name, paths, leon_part, out_dir, fuzzy, leon_hash = task
+    charges = compact_columns(pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True))
+    df_display, df_unmatched, summary = run_audit([charges], LeonIndex(leon_part, source_hash=leon_hash), fuzzy=fuzzy)
+
+    target = os.path.join(out_dir, name)
+    os.makedirs(target, exist_ok=True)
+    summary = {'partition': name, **summary, 'leon_rows': len(leon_part), 'leon_hash': leon_hash, 'fuzzy': fuzzy}
+    _replace_file(os.path.join(target, 'results.parquet'), lambda path: df_display.to_parquet(path, index=False))
+    _replace_file(os.path.join(target, 'unmatched.parquet'), lambda path: df_unmatched.to_parquet(path, index=False))
+    with open(os.path.join(target, 'summary.json.tmp'), 'w') as summary_file:
+        json.dump(summary, summary_file, indent=2)
+    os.replace(os.path.join(target, 'summary.json.tmp'), os.path.join(target, 'summary.json'))
+    return summary
+
+def _leon_tasks(staged, leon_df, out_dir, freq, fuzzy, leon_hash=None):
+    """משימת התאמה לכל מחיצה, עם הטווח של לאון שנחתך מהדוח הממוין לפי תאריך"""
+    leon_sorted = leon_df.dropna(subset=['Date ADEP']).sort_values('Date ADEP', kind='stable')
+    dates = leon_sorted['Date ADEP'].to_numpy()
+    for name in sorted(staged):
+        if name == UNDATED:
+            leon_part = leon_sorted.iloc[:0]
+        else:
+            start, end = partition_bounds(name, freq)
+            leon_part = leon_sorted.iloc[dates.searchsorted(start.to_datetime64(), 'left'):
+                                         dates.searchsorted(end.to_datetime64(), 'right')]
+        yield name, staged[name], leon_part, out_dir, fuzzy, leon_hash
+
+def reconcile_staged(staged, leon_df, out_dir, freq='M', fuzzy=True, workers=1, profile=None, leon_hash=None):
+    """
+    מתאים כל מחיצה בנפרד (במקביל בתהליכים אם workers > 1) וכותב אותה ל-out_dir/<מחיצה>.
+    מחיצות שאינן ב-staged לא נפתחות. leon_hash (של קובץ לאון) נשמר בסיכום של כל מחיצה.
+    מחזיר את רשימת הסיכומים לפי שם המחיצה.
+    """
+    profile = profile if profile is not None else StageProfile()
+    tasks = _leon_tasks(staged, leon_df, out_dir, freq, fuzzy, leon_hash)
+    with profile.stage('match_partitions') as measured:
+        if workers > 1 and len(staged) > 1:
+            workers = min(workers, len(staged))
+            with ProcessPoolExecutor(max_workers=workers, mp_context=worker_context()) as pool:
+                # חיתוך לאון של מחיצה נבנה רק כשמגיע תורה, ולא כל המחיצות מראש
+                summaries = list(_bounded_map(pool, reconcile_partition, tasks, workers * PARALLEL_TASKS_PER_WORKER))
+        else:
+            summaries = [reconcile_partition(task) for task in tasks]
+        measured['rows'] = sum(summary['total_flights'] for summary in summaries)
+    return summaries
+
+def read_summaries(out_dir, partitions=None):
+    """הסיכומים (summary.json) של המחיצות הגמורות ב-out_dir, לפי שם המחיצה"""
+    summaries = {}
+    for entry in sorted(os.scandir(out_dir), key=lambda entry: entry.name):
+        path = os.path.join(entry.path, 'summary.json')
+        if entry.is_dir() and os.path.exists(path) and (partitions is None or entry.name in partitions):
+            with open(path) as summary_file:
+                summaries[entry.name] = json.load(summary_file)
+    return summaries
+
+def partition_options(summaries):
+    """
+    הצירופים השונים של (hash של לאון, fuzzy) בסיכומי המחיצות - יותר מאחד אומר שחלק מהמחיצות
+    נבנו מחדש מול דוח לאון אחר או עם אפשרות fuzzy אחרת. מחזיר מילון צירוף -> שמות המחיצות.
+    """
+    options = {}
+    for name, summary in summaries.items():
+        options.setdefault((summary.get('leon_hash'), summary.get('fuzzy')), []).append(name)
+    return options
+
+def read_partitions(out_dir, partitions=None, kind='results'):
+    """
+    קורא חזרה את התוצאות (kind='results' או 'unmatched') של המחיצות הגמורות (עם summary.json).
+    מחיצות שהותאמו מול דוחות לאון שונים או עם אפשרות fuzzy שונה לא מחוברות (ValueError).
+    """
+    summaries = read_summaries(out_dir, partitions)
+    options = partition_options(summaries)
+    if len(options) > 1:
+        details = '; '.join(f"leon {leon_hash and leon_hash[:12]}, fuzzy {fuzzy}: {', '.join(names)}"
+                            for (leon_hash, fuzzy), names in options.items())
+        raise ValueError(f"Partitions were reconciled with different Leon reports or fuzzy options ({details})")
+    names = list(summaries)
+    frames = [pd.read_parquet(os.path.join(out_dir, name, f"{kind}.parquet")) for name in names]
+    return compact_columns(pd.concat(frames, ignore_index=True)) if frames else pd.DataFrame()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile Eurocontrol PF invoices against a Leon report, "
+                                                 "one date partition at a time.")
+    parser.add_argument('--euro', nargs='+', required=True, metavar='PATH',
+                        help="Eurocontrol PF files or directories of them (*.txt)")
+    parser.add_argument('--leon', required=True, help="Leon report (Excel/CSV)")
+    parser.add_argument('--out-dir', required=True, help="Directory with one sub-directory per partition")
+    parser.add_argument('--partition-by', choices=PARTITION_FREQS, default='month', help="Partition size")
+    parser.add_argument('--partitions', nargs='+', metavar='NAME',
+                        help="Only (re)build these partitions, e.g. 2024-03 (others are left untouched)")
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('AUDITOR_WORKERS', os.cpu_count() or 1)),
+                        help="Parser and matching processes (default: AUDITOR_WORKERS or CPU count)")
+    parser.add_argument('--no-fuzzy', action='store_true', help="Exact matching tiers only")
+    parser.add_argument('--no-cache', action='store_true', help="Do not use the on-disk parse cache")
+    parser.add_argument('--profile', metavar='JSON', help="Write stage timings and parser counters to this file")
+    args = parser.parse_args(argv)
+
+    pf_paths = collect_pf_files(args.euro)
+    if not pf_paths:
+        print("No Eurocontrol files found.", file=sys.stderr)
+        return 1
+    freq = PARTITION_FREQS[args.partition_by]
+    if args.partitions:
+        try:
+            for name in args.partitions:
+                if name != UNDATED:
+                    pd.Period(name, freq=freq)
+        except ValueError:
+            parser.error(f"--partitions: {name!r} is not a {args.partition_by} (e.g. 2024-03 for month)")
+
+    profile = StageProfile()
+    try:
+        with open(args.leon, 'rb') as leon_file:
+            leon_data = leon_file.read()
+    except OSError as e:
+        print(f"Error reading Leon file: {e!r}", file=sys.stderr)
+        return 1
+    leon_hash = hashlib.sha256(leon_data).hexdigest()
+    # הנתיב המלא הוא שם הקובץ: קבצים עם אותו שם בתיקיות שונות לא מתערבבים בשחזור השורות
+    files = []
+    try:
+        for path in pf_paths:
+            files.append((path, open_pf_file(path)))
+    except OSError as e:
+        close_pf_files(files)
+        print(f"Error reading Eurocontrol file: {e!r}", file=sys.stderr)
+        return 1
+    cache = None if args.no_cache else ParseCache()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=args.out_dir)
+    try:
+        # דוח לאון נטען ב-thread נפרד בזמן שהחשבוניות מפוענחות ומחולקות
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            leon_future = executor.submit(load_leon_report, leon_data, os.path.basename(args.leon))
+            staged = stage_charges(iter_euro_source(files, workers=args.workers, cache=cache), staging,
+                                   freq=freq, partitions=args.partitions, buffers=dict(files), profile=profile)
+            with profile.stage('leon_wait'):
+                try:
+                    leon_df = leon_future.result()
+                except Exception as e:
+                    print(f"Error reading Leon file: {e!r}", file=sys.stderr)
+                    return 1
+        if not staged:
+            print("No valid flight lines found in the selected partitions.", file=sys.stderr)
+            return 1
+        summaries = reconcile_staged(staged, leon_df, args.out_dir, freq=freq, fuzzy=not args.no_fuzzy,
+                                     workers=args.workers, profile=profile, leon_hash=leon_hash)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+        close_pf_files(files)
+
+    for summary in summaries:
+        print(f"{summary['partition']}: {summary['total_flights']} flights, €{summary['total_amount']:,.2f}, "
+              f"{summary['matched_flights']} matched ({summary['match_rate']:.1f}%)")
+    total_flights = sum(summary['total_flights'] for summary in summaries)
+    matched_flights = sum(summary['matched_flights'] for summary in summaries)
+    print(f"{len(pf_paths)} files, {len(summaries)} partitions, {total_flights} flights, "
+          f"{matched_flights} matched -> {args.out_dir}")
+    # בנייה מחדש של חלק מהמחיצות עם דוח לאון אחר או fuzzy אחר משאירה תיקייה מעורבת
+    stale = [name for (other_hash, other_fuzzy), names in partition_options(read_summaries(args.out_dir)).items()
+             if (other_hash, other_fuzzy) != (leon_hash, not args.no_fuzzy) for name in names]
+    if stale:
+        print(f"Warning: {len(stale)} partitions in {args.out_dir} were reconciled with another Leon report or "
+              f"fuzzy option and were not rebuilt: {', '.join(stale)}", file=sys.stderr)
+    if args.profile:
+        with open(args.profile, 'w') as profile_file:
+            profile_file.write(profile.to_json())
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+מדידת שלבי הביקורת: זמן, שורות לשנייה ושיא זיכרון לכל שלב, ומונים (שורות שנפסלו, מסלולי פענוח).
+הדו"ח הוא מילון פשוט שנשמר כ-JSON להשוואה בין ריצות.
+"""
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+class StageProfile:
+    """
+    אוסף מדידות לפי שם שלב. שלב שנמדד כמה פעמים (למשל פענוח של כל מקטע) מצטבר.
+    שיא הזיכרון נמדד עם tracemalloc רק אם memory=True, כי המעקב מאט את הריצה.
+    אפשר למדוד שלבים מכמה threads. השיא של tracemalloc משותף לכל התהליך, ולכן מדידה של שלב
+    שרץ במקביל לשלב אחר (בחלק מהזמן) לא נכנסת ל-peak_bytes אלא נספרת ב-overlapped_calls.
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.stages = {}
+        self.counters = {}
+        self.started = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self._lock = threading.Lock()
+        # מספר השלבים הפתוחים ומונה כל הפתיחות - לזיהוי שלבים חופפים
+        self._active = 0
+        self._entered = 0
+        self._owns_tracing = memory and not tracemalloc.is_tracing()
+        if self._owns_tracing:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, rows=0):
+        """מודד את הבלוק. אפשר לעדכן את מספר השורות דרך המילון שמוחזר ('rows')"""
+        measured = {'rows': rows}
+        with self._lock:
+            overlapped = self._active > 0
+            if self.memory and not overlapped:
+                tracemalloc.reset_peak()
+            self._active += 1
+            self._entered += 1
+            entered = self._entered
+        start = time.perf_counter()
+        try:
+            yield measured
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self._active -= 1
+                # חופף גם אם שלב אחר התחיל בזמן שזה רץ
+                overlapped = overlapped or self._entered != entered
+                self._add(name, seconds, measured['rows'], overlapped)
+
+    def iterate(self, name, frames):
+        """עוטף איטרטור של DataFrame-ים ומודד את הזמן של הפקת כל אחד (למשל פענוח עצל)"""
+        frames = iter(frames)
+        while True:
+            with self.stage(name) as measured:
+                frame = next(frames, None)
+                measured['rows'] = 0 if frame is None else len(frame)
+            if frame is None:
+                return
+            yield frame
+
+    def count(self, counters):
+        """מוסיף למונים (מילון שם -> כמות)"""
+        with self._lock:
+            for name, value in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def _add(self, name, seconds, rows, overlapped):
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'rows': 0, 'calls': 0})
+        stage['seconds'] += seconds
+        stage['rows'] += rows
+        stage['calls'] += 1
+        if not self.memory:
+            return
+        if overlapped:
+            stage['overlapped_calls'] = stage.get('overlapped_calls', 0) + 1
+        else:
+            stage['peak_bytes'] = max(stage.get('peak_bytes', 0), tracemalloc.get_traced_memory()[1])
+
+    def report(self):
+        stages = {}
+        with self._lock:
+            snapshot = {name: dict(stage) for name, stage in self.stages.items()}
+            counters = dict(self.counters)
+        for name, stage in snapshot.items():
+            seconds = stage['seconds']
+            stages[name] = {
+                **stage,
+                'seconds': round(seconds, 4),
+                'rows_per_sec': round(stage['rows'] / seconds) if seconds and stage['rows'] else None,
+            }
+        return {'started': self.started, 'stages': stages, 'counters': counters}
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2)
+
+    def close(self):
+        """מפסיק את מעקב הזיכרון (אם הופעל כאן)"""
+        if self._owns_tracing:
+            tracemalloc.stop()
+            self._owns_tracing = False
@@ -0,0 +1,52 @@
+"""
+קוביית הסיכומים: מיזוג קוביות של קבצים זהה לקובייה שנבנית מכל השורות יחד,
+ושורה בלי תאריך (NaT) נספרת בסכומים בלי להופיע כחודש.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from analytics import DIMENSIONS, build_cube, cube_months, cube_view, exposure, merge_cubes
+
+def charges(count, seed):
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 120, count), unit='D')
+    matched = rng.random(count) < 0.7
+    return pd.DataFrame({
+        'Date': pd.Series(dates).where(rng.random(count) > 0.05),
+        'Invoice No': rng.choice(['GM/1/24', 'GM/2/24'], count),
+        'Charge Type': rng.choice(['Route Charges', 'Terminal/Other'], count),
+        'Reg': rng.choice(['4XABA', '4XABB', '4XABC'], count),
+        'Dep': rng.choice(['LLBG', 'EGLL'], count),
+        'Arr': rng.choice(['LFPG', 'EDDF'], count),
+        'Leon Trip Number': np.where(matched, rng.integers(100, 110, count), np.nan),
+        'Matched?': np.where(matched, 'YES', 'NO'),
+        'Amount_Cents': rng.integers(100, 900_000, count),
+    })
+
+def sorted_view(cube, dimension):
+    view = cube_view(cube, dimension)
+    return view.sort_values(list(view.columns), na_position='first', ignore_index=True)
+
+@pytest.mark.parametrize('dimension', list(DIMENSIONS))
+def test_merged_cubes_equal_single_pass(dimension):
+    parts = [charges(400, seed) for seed in range(3)]
+    single = build_cube(pd.concat(parts, ignore_index=True))
+    merged = merge_cubes([build_cube(part) for part in parts])
+    pd.testing.assert_frame_equal(sorted_view(merged, dimension), sorted_view(single, dimension), check_dtype=False)
+
+def test_nat_dates_count_without_a_month():
+    df = charges(200, 4)
+    df.loc[:9, 'Date'] = pd.NaT
+    cube = build_cube(df)
+
+    months = cube_months(cube)
+    assert months and all(isinstance(month, str) for month in months)
+    total, unmatched = exposure(cube)
+    assert total == df['Amount_Cents'].sum() / 100
+    assert unmatched == df.loc[df['Matched?'] != 'YES', 'Amount_Cents'].sum() / 100
+    # בחירת חודשים מוציאה את השורות בלי תאריך
+    dated = df[df['Date'].notna()]
+    assert exposure(cube, months)[0] == dated['Amount_Cents'].sum() / 100
+    assert cube_view(cube, 'Registration', months)['Flights'].sum() == len(dated)
+    assert cube_view(cube, 'Registration')['Flights'].sum() == len(df)
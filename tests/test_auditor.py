@@ -0,0 +1,64 @@
+"""
+הרצת auditor.py מקצה לקצה: השורה הגולמית של שורה שלא הותאמה נלקחת מהקובץ שלה,
+גם כשלשני קבצים בתיקיות שונות יש אותו שם. קובץ שלא נקרא או שגיאת פענוח מדווחים בהודעה
+(ולא ב-traceback), והמיפויים של קבצי ה-PF נסגרים.
+"""
+import random
+
+import pandas as pd
+
+from auditor import main
+from bench import generate_dataset
+from eurocontrol import parse_eurocontrol_line
+
+def test_same_file_name_in_two_directories(tmp_path):
+    pf_bytes, leon_csv = generate_dataset(2000, seed=5, leon_coverage=0.7)
+    lines = pf_bytes.split(b'\r\n')
+    # הרשומות מעורבבות, והכותרת ורשומת הסיכום נשארות במקומן
+    shuffled = lines[3:-1]
+    random.Random(1).shuffle(shuffled)
+    for directory, content in (('x', pf_bytes), ('y', b'\r\n'.join(lines[:3] + shuffled + lines[-1:]))):
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / 'A_PF.txt').write_bytes(content)
+    (tmp_path / 'leon.csv').write_bytes(leon_csv)
+
+    out = tmp_path / 'report.csv'
+    assert main(['--euro', str(tmp_path / 'x'), str(tmp_path / 'y'), '--leon', str(tmp_path / 'leon.csv'),
+                 '--out', str(out), '--workers', '1', '--no-cache']) == 0
+
+    unmatched = pd.read_csv(tmp_path / 'report_unmatched.csv')
+    assert len(unmatched) > 0
+    for row in unmatched.itertuples():
+        parsed = parse_eurocontrol_line(row.Raw_Line)
+        assert parsed is not None
+        # בנתונים הסינתטיים החיוב הוא המספר האחרון בשורה (היחידות לפניו)
+        assert row.Raw_Line.split()[-1] == f"{row.Amount:.2f}".replace('.', ',')
+        assert str(pd.Timestamp(parsed['Date']).date()) == row.Date
+
+def test_unreadable_inputs_are_reported(tmp_path, capsys):
+    pf_bytes, leon_csv = generate_dataset(200, seed=1)
+    (tmp_path / 'A_PF.txt').write_bytes(pf_bytes)
+    (tmp_path / 'leon.csv').write_bytes(leon_csv)
+    out = str(tmp_path / 'report.csv')
+
+    assert main(['--euro', str(tmp_path / 'missing.txt'), '--leon', str(tmp_path / 'leon.csv'), '--out', out]) == 1
+    assert 'Error reading Eurocontrol file' in capsys.readouterr().err
+    assert main(['--euro', str(tmp_path / 'A_PF.txt'), '--leon', str(tmp_path / 'missing.csv'), '--out', out]) == 1
+    assert 'Error reading Leon file' in capsys.readouterr().err
+
+def test_parser_error_is_reported(tmp_path, capsys, monkeypatch):
+    pf_bytes, leon_csv = generate_dataset(200, seed=1)
+    (tmp_path / 'A_PF.txt').write_bytes(pf_bytes)
+    (tmp_path / 'leon.csv').write_bytes(leon_csv)
+    opened = []
+
+    def failing_source(files, **kwargs):
+        opened.extend(data for _, data in files)
+        raise RuntimeError('corrupt PF file')
+        yield
+
+    monkeypatch.setattr('auditor.iter_euro_source', failing_source)
+    assert main(['--euro', str(tmp_path / 'A_PF.txt'), '--leon', str(tmp_path / 'leon.csv'),
+                 '--out', str(tmp_path / 'report.csv'), '--no-cache']) == 1
+    assert "Error reading Eurocontrol files: RuntimeError('corrupt PF file')" in capsys.readouterr().err
+    assert opened and all(data.closed for data in opened)
@@ -0,0 +1,65 @@
+"""
+יומן ההתאמות מגיש תוצאה שמורה רק מול אותו דוח לאון ואותה אפשרות fuzzy.
+"""
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ledger import Ledger
+from matching import LeonIndex
+
+def leon_report(trip):
+    return pd.DataFrame({
+        'Date ADEP': pd.to_datetime(['2024-05-01']),
+        'Aircraft_Clean': ['4XABA'],
+        'Flight_Clean': ['ELY1'],
+        'ADEP ICAO': ['LLBG'],
+        'ADES ICAO': ['EGLL'],
+        'Trip number': [trip],
+    })
+
+def charges():
+    return pd.DataFrame({
+        'Date': pd.to_datetime(['2024-05-01']),
+        'Callsign': ['X'],
+        'Reg': ['4XABA'],
+        'Dep': ['LLBG'],
+        'Arr': ['EGLL'],
+        'Amount_Cents': np.array([12345], dtype=np.int64),
+        'Invoice No': ['GM/1/24'],
+        'Source File': ['A_PF.txt'],
+        'Raw_Line': ['A0001 2024/05/01 4XABA LLBGEGLL 123,45'],
+    })
+
+def test_reuse_needs_same_leon_and_fuzzy(tmp_path):
+    ledger = Ledger(str(tmp_path / 'ledger.sqlite3'))
+    full = LeonIndex(leon_report(101.0), source_hash='full')
+    other = LeonIndex(leon_report(np.nan), source_hash='other')
+
+    assert not ledger.reconcile(charges(), full)['From Ledger'].any()
+    assert ledger.reconcile(charges(), full)['From Ledger'].all()
+    assert not ledger.reconcile(charges(), full, fuzzy=False)['From Ledger'].any()
+
+    result = ledger.reconcile(charges(), other)
+    assert not result['From Ledger'].any()
+    assert result['Matched?'].tolist() == ['NO']
+
+def test_ledger_needs_leon_hash(tmp_path):
+    ledger = Ledger(str(tmp_path / 'ledger.sqlite3'))
+    with pytest.raises(ValueError):
+        ledger.reconcile(charges(), LeonIndex(leon_report(101.0)))
+
+def test_old_ledger_is_migrated_and_not_reused(tmp_path):
+    path = str(tmp_path / 'ledger.sqlite3')
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE charges (invoice_no TEXT NOT NULL, line_hash INTEGER NOT NULL, "
+                     "charge_key INTEGER NOT NULL, source_file TEXT, flight_date TEXT, reg TEXT, dep TEXT, arr TEXT, "
+                     "amount REAL, leon_trip, matched TEXT, match_method TEXT, match_confidence REAL, "
+                     "PRIMARY KEY (invoice_no, line_hash))")
+    conn.close()
+    ledger = Ledger(path)
+    leon_index = LeonIndex(leon_report(101.0), source_hash='full')
+    assert not ledger.reconcile(charges(), leon_index)['From Ledger'].any()
+    assert ledger.reconcile(charges(), leon_index)['From Ledger'].all()
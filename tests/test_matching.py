@@ -0,0 +1,102 @@
+"""
+התאמה מול לאון: שורת לאון בלי מספר טיול לא נחשבת התאמה, לא במדויק ולא בסלחני.
+השכבות הסלחניות: ציון הביטחון, REVIEW לביטחון נמוך, ולא משתמשות בטיול שכבר הותאם.
+דוח לאון נטען אותו דבר מ-CSV ומאקסל.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from bench import generate_dataset
+from eurocontrol import detect_layout, parse_eurocontrol_bytes
+from matching import MATCH_TIERS, LeonIndex, load_leon_report, match_flights
+
+def leon_report(trips):
+    count = len(trips)
+    return pd.DataFrame({
+        'Date ADEP': pd.to_datetime(['2024-05-01'] * count),
+        'Aircraft_Clean': [f"4XAB{chr(ord('A') + i)}" for i in range(count)],
+        'Flight_Clean': [f"ELY{i}" for i in range(count)],
+        'ADEP ICAO': ['LLBG'] * count,
+        'ADES ICAO': ['EGLL'] * count,
+        'Trip number': trips,
+    })
+
+@pytest.mark.parametrize('fuzzy', [True, False])
+def test_leon_row_without_trip_is_not_a_match(fuzzy):
+    leon = leon_report([101.0, np.nan])
+    euro = pd.DataFrame({
+        'Date': pd.to_datetime(['2024-05-01', '2024-05-01', '2024-05-01', '2024-05-02']),
+        'Reg': ['4XABA', '4XABB', '4XZZZ', '4XABB'],
+        'Callsign': ['X', 'X', 'ELY1', 'X'],
+        'Dep': ['LLBG'] * 4,
+        'Arr': ['EGLL'] * 4,
+    })
+    matched = match_flights(euro, LeonIndex(leon), fuzzy=fuzzy)
+    assert matched['Matched?'].tolist() == ['YES', 'NO', 'NO', 'NO']
+    assert matched['Leon Trip Number'].iloc[0] == 101.0
+    assert matched['Leon Trip Number'].iloc[1:].isna().all()
+
+def invoice(rows):
+    """שורות חשבונית (תאריך, רישום, מוצא, יעד) עם אות קריאה שלא קיים בלאון"""
+    dates, regs, deps, arrs = zip(*rows)
+    return pd.DataFrame({'Date': pd.to_datetime(list(dates)), 'Reg': list(regs), 'Callsign': ['X'] * len(rows),
+                         'Dep': list(deps), 'Arr': list(arrs)})
+
+@pytest.mark.parametrize('row, method, confidence, status', [
+    (('2024-05-01', '4x-aba', 'LLBG', 'EGLL'), 'Fuzzy: Date ±1 day', 0.9, 'YES'),
+    (('2024-05-02', '4XABA', 'LLBG', 'EGLL'), 'Fuzzy: Date ±1 day', 0.75, 'YES'),
+    (('2024-05-01', '4XABA', 'LLBG', 'LFPG'), 'Fuzzy: Diverted arrival', 0.6, 'REVIEW'),
+    (('2024-04-30', '4XABA', 'LLBG', 'LFPG'), 'Fuzzy: Diverted arrival', 0.45, 'REVIEW'),
+    (('2024-05-03', '4XABA', 'LLBG', 'EGLL'), '-', None, 'NO'),
+])
+def test_fuzzy_tiers(row, method, confidence, status):
+    matched = match_flights(invoice([row]), LeonIndex(leon_report([101.0])))
+    assert matched['Match Method'].tolist() == [method]
+    assert matched['Matched?'].tolist() == [status]
+    if confidence is None:
+        assert matched['Match Confidence'].isna().all()
+    else:
+        assert matched['Match Confidence'].tolist() == [confidence]
+        assert matched['Leon Trip Number'].tolist() == [101.0]
+
+def test_fuzzy_skips_trips_matched_exactly():
+    rows = [('2024-05-01', '4XABA', 'LLBG', 'LFPG'), ('2024-05-01', '4XABA', 'LLBG', 'EGLL')]
+    matched = match_flights(invoice(rows), LeonIndex(leon_report([101.0])))
+    assert matched['Match Method'].tolist() == ['-', 'Registration']
+    assert matched['Matched?'].tolist() == ['NO', 'YES']
+
+def test_fuzzy_trip_is_used_once_across_chunks():
+    leon_index = LeonIndex(leon_report([101.0]))
+    claimed = set()
+    rows = [('2024-05-02', '4XABA', 'LLBG', 'EGLL'), ('2024-05-01', '4XABA', 'LLBG', 'LFPG')]
+    first = match_flights(invoice(rows), leon_index, claimed=claimed)
+    assert first['Match Method'].tolist() == ['Fuzzy: Date ±1 day', '-']
+    second = match_flights(invoice(rows[:1]), leon_index, claimed=claimed)
+    assert second['Matched?'].tolist() == ['NO']
+    assert claimed == {101.0}
+
+def test_bench_dataset_fuzzy_matches_are_not_reused():
+    pf_bytes, leon_csv = generate_dataset(3000, seed=3)
+    _, layout = detect_layout('A_BENCH.txt', pf_bytes)
+    matched = match_flights(parse_eurocontrol_bytes(pf_bytes, layout=layout), LeonIndex(load_leon_report(leon_csv, 'leon.csv')))
+    exact = matched['Match Method'].isin(list(MATCH_TIERS))
+    fuzzy = matched['Match Method'].str.startswith('Fuzzy')
+    assert not matched.loc[fuzzy, 'Leon Trip Number'].isin(matched.loc[exact, 'Leon Trip Number']).any()
+    assert not matched.loc[fuzzy, 'Leon Trip Number'].duplicated().any()
+    assert set(matched['Match Confidence'].dropna()) <= {1.0, 0.9, 0.75, 0.6, 0.45}
+    assert (matched.loc[matched['Matched?'] == 'YES', 'Match Confidence'] >= 0.75).all()
+
+def test_duplicate_key_keeps_the_row_with_a_trip():
+    leon = pd.concat([leon_report([101.0]), leon_report([np.nan])], ignore_index=True)
+    euro = pd.DataFrame({'Date': pd.to_datetime(['2024-05-01']), 'Reg': ['4XABA'], 'Callsign': ['X'],
+                         'Dep': ['LLBG'], 'Arr': ['EGLL']})
+    matched = match_flights(euro, LeonIndex(leon))
+    assert matched['Leon Trip Number'].tolist() == [101.0]
+
+def test_leon_report_csv_and_xlsx_load_the_same():
+    _, leon_csv = generate_dataset(500, seed=2)
+    _, leon_xlsx = generate_dataset(500, seed=2, leon_format='xlsx')
+    from_csv = load_leon_report(leon_csv, 'leon.csv')
+    from_xlsx = load_leon_report(leon_xlsx, 'leon.xlsx')
+    pd.testing.assert_frame_equal(from_xlsx, from_csv, check_dtype=False)
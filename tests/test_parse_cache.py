@@ -0,0 +1,61 @@
+"""
+המטמון מחזיר את אותן שורות כמו פענוח ישיר - בפענוח ראשון, בקריאה מהמטמון ואחרי עצירה באמצע.
+"""
+import os
+
+import pandas as pd
+import pytest
+
+from bench import generate_dataset
+from eurocontrol import iter_eurocontrol_buffers
+from parse_cache import ParseCache, iter_eurocontrol_cached
+
+COLUMNS = ['Date', 'Callsign', 'Reg', 'Dep', 'Arr', 'Amount_Cents', 'Parse Path', 'Line_Start', 'Line_End',
+           'Charge Type', 'Invoice No', 'Source File']
+
+@pytest.fixture(scope='module')
+def files():
+    pf_bytes, _ = generate_dataset(3000, seed=3)
+    # שני קבצים עם אותו תוכן ואותו סוג חיוב (אותו מפתח), וקובץ בסוג חיוב אחר
+    return [('A_ONE.txt', pf_bytes), ('A_TWO.txt', pf_bytes), ('M_THREE.txt', pf_bytes[:len(pf_bytes) // 2])]
+
+def collect(chunks):
+    chunks = list(chunks)
+    frame = pd.concat(chunks, ignore_index=True)[COLUMNS]
+    counts = {}
+    for chunk in chunks:
+        for name, value in chunk.attrs.get('parse_counts', {}).items():
+            counts[name] = counts.get(name, 0) + value
+    return frame, counts, len(chunks)
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_cached_matches_direct(tmp_path, files, monkeypatch, workers):
+    monkeypatch.setattr('parse_cache.CACHE_READ_ROWS', 1000)
+    cache = ParseCache(directory=str(tmp_path))
+    direct, direct_counts, _ = collect(iter_eurocontrol_buffers(files))
+
+    first, first_counts, _ = collect(iter_eurocontrol_cached(files, cache, workers=workers))
+    second, second_counts, chunks = collect(iter_eurocontrol_cached(files, cache, workers=workers))
+
+    pd.testing.assert_frame_equal(first, direct, check_categorical=False)
+    pd.testing.assert_frame_equal(second, direct, check_categorical=False)
+    assert first_counts == second_counts == direct_counts
+    assert chunks > len(files)
+    assert cache.stats()['files'] == 2 and cache.hits == 3
+
+def test_stopped_consumer_leaves_no_partial_entry(tmp_path, files):
+    cache = ParseCache(directory=str(tmp_path))
+    chunks = iter_eurocontrol_cached(files[2:], cache, workers=1)
+    next(chunks)
+    chunks.close()
+    assert os.listdir(tmp_path) == []
+
+def test_corrupt_entry_is_parsed_again(tmp_path, files):
+    cache = ParseCache(directory=str(tmp_path))
+    direct, _, _ = collect(iter_eurocontrol_cached(files[2:], cache, workers=1))
+    for entry in os.scandir(tmp_path):
+        with open(entry.path, 'wb') as entry_file:
+            entry_file.write(b'not parquet')
+    again, _, _ = collect(iter_eurocontrol_cached(files[2:], cache, workers=1))
+    pd.testing.assert_frame_equal(again, direct, check_categorical=False)
+    assert cache.misses == 2
@@ -0,0 +1,208 @@
+"""
+השוואה בין הפענוח המרוכז (parse_eurocontrol_lines / parse_eurocontrol_bytes) לבין
+parse_eurocontrol_line - עם פריסה קבועה ובלעדיה.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from eurocontrol import (detect_layout, invoice_total_cents, iter_eurocontrol_buffers, parse_eurocontrol_bytes,
+                         parse_eurocontrol_line, parse_eurocontrol_lines, to_datetime_ns)
+
+HEADER = ['HEADER INVOICE GM/123456/24 EUROCONTROL', 'SECOND HEADER', '']
+
+def record(identity, route, amount, date='2024/05/05', units='12'):
+    return f"ABC123401{date}      {identity:<10}   {route:<8}           {units:>2} {amount:>8}  0,00  X"
+
+def expected(lines):
+    """התוצאה של הפענוח הבודד, באותה צורה כמו הפענוח המרוכז"""
+    rows = [row for row in map(parse_eurocontrol_line, lines) if row is not None]
+    frame = pd.DataFrame(rows, columns=['Date', 'Callsign', 'Reg', 'Dep', 'Arr', 'Amount'])
+    frame['Date'] = to_datetime_ns(frame['Date'], format='%Y-%m-%d')
+    frame['Amount_Cents'] = np.rint(frame.pop('Amount').astype(float) * 100).astype('int64')
+    return frame
+
+def assert_parity(parsed, lines):
+    columns = ['Date', 'Callsign', 'Reg', 'Dep', 'Arr', 'Amount_Cents']
+    actual = parsed[columns].astype({column: object for column in columns[1:5]})
+    pd.testing.assert_frame_equal(actual.reset_index(drop=True), expected(lines)[columns], check_dtype=False)
+
+def test_amount_wider_than_sample():
+    lines = HEADER + [record(f"ELY{i:03d}", 'LLBGLFPG', f"{1000 + i},50") for i in range(300)]
+    lines.append(record('ELY999', 'LLBGLFPG', '12345,67'))
+    data = '\n'.join(lines).encode()
+    _, layout = detect_layout('A_WIDE.txt', data)
+    assert layout is not None
+
+    parsed = parse_eurocontrol_bytes(data, layout=layout)
+    assert_parity(parsed, lines)
+    assert parsed['Amount_Cents'].iat[-1] == 1234567
+    assert parsed['Parse Path'].iat[-1] == 'heuristic'
+
+@pytest.mark.parametrize('identity, reg', [('4XGEUD', '4XGEU'), ('4XCIL,', '4XCIL'), ('4X-EDF', '4XEDF'),
+                                           ('N123AB', 'N123AB'), ('HEZ333', 'HEZ333')])
+def test_fixed_path_registration(identity, reg):
+    lines = HEADER + [record('ELY001', 'LLBGLFPG', '1000,50')] * 20 + [record(identity, 'LLBGLFPG', '1000,50')]
+    data = '\n'.join(lines).encode()
+    _, layout = detect_layout('A_REG.txt', data)
+
+    parsed = parse_eurocontrol_lines(lines, layout=layout)
+    assert_parity(parsed, lines)
+    assert parsed['Reg'].iat[-1] == reg
+
+def test_out_of_range_date_is_nat():
+    lines = [record('ELY001', 'LLBGLFPG', '1000,50', date='2924/03/05'),
+             record('ELY002', 'LLBGLFPG', '1000,50', date='2024/03/05')]
+    parsed = parse_eurocontrol_lines(lines)
+    assert parsed['Date'].dtype == 'datetime64[ns]'
+    assert parsed['Date'].isna().tolist() == [True, False]
+    assert parsed['Amount_Cents'].tolist() == [100050, 100050]
+
+IDENTITIES = ['4X-EDF', '4XABC', '4XGEUD', 'N123AB', 'N7', 'ELY783', 'HEZ333', 'LY001', '4XCIL,', 'ABC-DEF']
+ROUTES = ['LLBGLFPG', 'EDDFLLBG', 'llbgeddf', 'LLBG', 'LIRF LEMD', 'KJFKLLBG']
+AMOUNTS = ['3588,63', '12,00', '123456,78', '0,00', '77', '1,5', '', 'abc', '9999999,99']
+# תווים להחלפה ולהוספה בשורות המשובשות (בלי תווי שורה חדשה)
+FUZZ_CHARS = list('0123456789,,,   ABCXYZ4N-/.') + ['é', 'ש', '\t']
+
+def generated_lines(count, seed):
+    rng = np.random.default_rng(seed)
+    lines = list(HEADER)
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.05:
+            lines.append(rng.choice(['', 'TOTAL 1234,56', 'ABC1234', 'ABC123402 2024/05/05  X']))
+            continue
+        # רוב השורות תקינות (כך שהפריסה מזוהה), והשאר עם שדות חריגים
+        if rng.random() < 0.7:
+            lines.append(record(rng.choice(IDENTITIES[:6]), 'LLBGLFPG', f"{rng.integers(1, 99999)},{rng.integers(0, 99):02d}"))
+            continue
+        line = record(rng.choice(IDENTITIES), rng.choice(ROUTES), rng.choice(AMOUNTS),
+                      date=rng.choice(['2024/05/05', '2024/12/31', '2024/13/01', '2924/03/05']),
+                      units=str(rng.integers(0, 99)))
+        if kind > 0.8:
+            # רווחים נוספים או חסרים לפני הסכום - הסכום זז מהעמודה שנדגמה
+            shift = int(rng.integers(-3, 4))
+            line = line[:60] + ' ' * shift + line[60:] if shift >= 0 else line[:60 + shift] + line[60:]
+        lines.append(line)
+    return lines
+
+def fuzzed_lines(lines, seed, mutations=3):
+    rng = np.random.default_rng(seed)
+    fuzzed = []
+    for line in lines:
+        chars = list(line)
+        for _ in range(int(rng.integers(0, mutations + 1))):
+            position = int(rng.integers(0, len(chars) + 1))
+            action = rng.random()
+            if action < 0.4 and position < len(chars):
+                chars[position] = rng.choice(FUZZ_CHARS)
+            elif action < 0.7:
+                chars.insert(position, rng.choice(FUZZ_CHARS))
+            elif position < len(chars):
+                del chars[position]
+        fuzzed.append(''.join(chars))
+    return fuzzed
+
+def layout_for(lines):
+    _, layout = detect_layout('A_PARITY.txt', '\n'.join(lines).encode())
+    return layout
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('fuzz', [False, True])
+@pytest.mark.parametrize('with_layout', [False, True])
+def test_parity_lines(seed, fuzz, with_layout):
+    lines = generated_lines(2000, seed)
+    if fuzz:
+        lines = fuzzed_lines(lines, seed)
+    layout = layout_for(lines) if with_layout else None
+    if with_layout:
+        assert layout is not None or fuzz
+
+    parsed = parse_eurocontrol_lines(lines, layout=layout)
+    assert_parity(parsed, lines)
+    assert (parsed['Parse Path'] == 'fixed').any() == (layout is not None)
+    raw = [row['Raw_Line'] for row in map(parse_eurocontrol_line, lines) if row is not None]
+    assert parsed['Raw_Line'].tolist() == raw
+
+# כל המפרידים של str.splitlines, שלפיו הקובץ חולק לשורות לפני הפענוח מהבתים
+NEWLINES = ['\n', '\r\n', '\r', '\x0b', '\x0c', '\x1c', '\x1d', '\x1e', '\x85', '\u2028', '\u2029']
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('fuzz', [False, True])
+@pytest.mark.parametrize('newline', NEWLINES)
+def test_parity_bytes(seed, fuzz, newline):
+    lines = generated_lines(2000, seed)
+    if fuzz:
+        lines = fuzzed_lines(lines, seed)
+    data = newline.join(lines).encode('utf-8')
+    assert data.decode('utf-8').splitlines() == lines
+
+    for layout in (None, layout_for(lines)):
+        parsed = parse_eurocontrol_bytes(data, layout=layout)
+        assert_parity(parsed, lines)
+        spans = parsed[['Line_Start', 'Line_End']].to_numpy()
+        raw = [row['Raw_Line'] for row in map(parse_eurocontrol_line, lines) if row is not None]
+        assert [data[start:end].decode('utf-8').strip() for start, end in spans] == raw
+        assert parsed.attrs['parse_counts']['lines'] == len(lines)
+
+@pytest.mark.parametrize('newline', ['\r\n', '\r', '\x0c', '\x1e'])
+def test_split_ranges_keep_records(newline):
+    lines = HEADER + generated_lines(2000, 0)
+    data = newline.join(lines).encode('utf-8')
+    frames = list(iter_eurocontrol_buffers([('A_SPLIT.txt', data)], chunk_bytes=4096))
+    assert len(frames) > 1
+    parsed = pd.concat(frames, ignore_index=True)
+    assert_parity(parsed, lines)
+    assert set(parsed['Invoice No']) == {'GM/123456/24'}
+
+def charge_cents(line):
+    """החיוב בשורת הנתונים הסינתטיים - המספר העשרוני האחרון בשורה (היחידות לפניו)"""
+    whole, fraction = line.split()[-1].split(',')
+    return int(whole) * 100 + int(fraction)
+
+def test_parity_bench_dataset():
+    from bench import generate_dataset
+
+    pf_bytes, _ = generate_dataset(5000, seed=7)
+    lines = pf_bytes.decode().split('\r\n')
+    _, layout = detect_layout('A_BENCH.txt', pf_bytes)
+    assert layout['amount_index'] == 1
+    parsed = parse_eurocontrol_bytes(pf_bytes, layout=layout)
+    records = [line for line in lines if line[7:9] == '01']
+    assert_parity(parsed.assign(Amount_Cents=expected(records)['Amount_Cents']), records)
+    assert parsed['Amount_Cents'].tolist() == [charge_cents(line) for line in records]
+    assert (parsed['Parse Path'] == 'fixed').mean() > 0.9
+
+@pytest.mark.parametrize('rows', [5, 3000])
+def test_bench_amounts_add_up_to_invoice_total(rows):
+    from bench import bench_size, generate_dataset
+
+    pf_bytes, _ = generate_dataset(rows, seed=rows)
+    _, layout = detect_layout('A_BENCH.txt', pf_bytes)
+    parsed = parse_eurocontrol_bytes(pf_bytes, layout=layout)
+    assert parsed['Amount_Cents'].sum() == invoice_total_cents(pf_bytes)
+    assert bench_size(rows, seed=rows)['parsed_rows'] == rows
+
+def units_record(identity, units, amount):
+    return f"ABC1234012024/05/05      {identity:<10}   LLBGLFPG  {units:>8}  {amount:>10}  X"
+
+@pytest.mark.parametrize('with_total', [True, False])
+def test_units_field_before_charge(with_total):
+    amounts = [f"{1000 + i * 7},{i % 100:02d}" for i in range(300)] + ['123456,78']
+    lines = HEADER + [units_record(f"ELY{i:03d}", f"{i % 400 + 1},00", amount) for i, amount in enumerate(amounts)]
+    total = sum(int(amount.replace(',', '')) for amount in amounts)
+    if with_total:
+        lines.append(f"ABC123402TOTAL {total // 100},{total % 100:02d}")
+    data = '\n'.join(lines).encode()
+    _, layout = detect_layout('A_UNITS.txt', data)
+
+    parsed = parse_eurocontrol_bytes(data, layout=layout)
+    if with_total:
+        # העמודה נבחרה לפי רשומת הסיכום - גם השורה הרחבה (היוריסטית) מקבלת את החיוב ולא את היחידות
+        assert layout['amount_index'] == 1
+        assert parsed['Amount_Cents'].sum() == total
+        assert parsed['Parse Path'].iat[-1] == 'heuristic'
+    else:
+        # בלי רשומת סיכום נשאר הכלל של הפענוח הבודד (המספר החיובי הראשון)
+        assert layout['amount_index'] == 0
+        assert_parity(parsed, lines)
@@ -0,0 +1,74 @@
+"""
+התאמה לפי מחיצות: שורות החשבונית מחולקות לפי חודש, לאון נחתך עם שולי חלון ההתאמה הסלחנית
+מעבר לגבולות החודש, ובנייה מחדש של מחיצה אחת לא נוגעת באחרות.
+"""
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from bench import generate_dataset
+from eurocontrol import iter_eurocontrol_buffers
+from partitions import _leon_tasks, main, read_partitions, stage_charges
+
+def test_staging_splits_by_month(tmp_path):
+    pf_bytes, _ = generate_dataset(3000, seed=3)
+    files = [('A_PF.txt', pf_bytes)]
+    direct = pd.concat(iter_eurocontrol_buffers(files), ignore_index=True)
+
+    staged = stage_charges(iter_eurocontrol_buffers(files, chunk_bytes=32 * 1024), str(tmp_path))
+    assert set(staged) == set(direct['Date'].dt.to_period('M').astype(str))
+    for name, paths in staged.items():
+        part = pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True)
+        assert (part['Date'].dt.to_period('M').astype(str) == name).all()
+        assert len(part) == (direct['Date'].dt.to_period('M').astype(str) == name).sum()
+
+    (tmp_path / 'only').mkdir()
+    only = stage_charges(iter_eurocontrol_buffers(files), str(tmp_path / 'only'), partitions=['2024-03'])
+    assert list(only) == ['2024-03']
+
+def test_leon_slice_crosses_month_boundaries():
+    leon = pd.DataFrame({'Date ADEP': pd.to_datetime(['2024-02-28', '2024-02-29', '2024-03-15', '2024-03-31',
+                                                      '2024-04-01', '2024-04-02', None]),
+                         'Trip number': [1, 2, 3, 4, 5, 6, 7]})
+    staged = {'2024-03': [], '2024-04': [], 'undated': []}
+    slices = {name: leon_part['Trip number'].tolist()
+              for name, _, leon_part, _, _, _ in _leon_tasks(staged, leon, 'out', 'M', True)}
+    # חלון ההתאמה הסלחנית הוא יום לכל כיוון
+    assert slices == {'2024-03': [2, 3, 4, 5], '2024-04': [4, 5, 6], 'undated': []}
+
+def summaries(out_dir):
+    result = {}
+    for name in sorted(os.listdir(out_dir)):
+        with open(os.path.join(out_dir, name, 'summary.json')) as summary_file:
+            result[name] = json.load(summary_file)
+    return result
+
+def test_rebuild_one_partition(tmp_path):
+    pf_bytes, leon_csv = generate_dataset(3000, seed=4)
+    (tmp_path / 'A_PF.txt').write_bytes(pf_bytes)
+    (tmp_path / 'leon.csv').write_bytes(leon_csv)
+    out_dir = tmp_path / 'out'
+    args = ['--euro', str(tmp_path / 'A_PF.txt'), '--leon', str(tmp_path / 'leon.csv'), '--out-dir', str(out_dir),
+            '--workers', '2', '--no-cache']
+
+    assert main(args) == 0
+    before = summaries(out_dir)
+    assert len(before) == 12 and len({(summary['leon_hash'], summary['fuzzy']) for summary in before.values()}) == 1
+    results = read_partitions(str(out_dir))
+    assert len(results) == 3000
+    assert round(results['Amount'].sum(), 2) == round(sum(summary['total_amount'] for summary in before.values()), 2)
+    other_files = {name: os.path.getmtime(out_dir / name / 'results.parquet') for name in before if name != '2024-03'}
+
+    # אותה מחיצה נבנית מחדש עם אותן אפשרויות - השאר לא נכתבות שוב
+    assert main(args + ['--partitions', '2024-03']) == 0
+    assert summaries(out_dir) == before
+    assert {name: os.path.getmtime(out_dir / name / 'results.parquet') for name in other_files} == other_files
+
+    # מחיצה שנבנתה בלי fuzzy לא מתחברת לאחרות
+    assert main(args + ['--partitions', '2024-03', '--no-fuzzy']) == 0
+    assert summaries(out_dir)['2024-03']['fuzzy'] is False
+    with pytest.raises(ValueError):
+        read_partitions(str(out_dir))
+    assert len(read_partitions(str(out_dir), partitions=['2024-03'])) == before['2024-03']['total_flights']
@@ -0,0 +1,54 @@
+"""
+מדידת השלבים: שיא זיכרון רק לשלבים שלא חפפו לשלב אחר, וזמן הפענוח נמדד ב-thread של הפענוח.
+"""
+import threading
+import time
+
+import pandas as pd
+
+from auditor import ChunkPrefetcher
+from profiling import StageProfile
+
+def test_overlapping_stages_have_no_peak():
+    profile = StageProfile(memory=True)
+    started = threading.Event()
+    release = threading.Event()
+
+    def background():
+        with profile.stage('background'):
+            started.set()
+            release.wait()
+
+    thread = threading.Thread(target=background)
+    thread.start()
+    started.wait()
+    with profile.stage('foreground'):
+        release.set()
+    thread.join()
+    with profile.stage('alone'):
+        data = bytearray(1024 * 1024)
+    profile.close()
+
+    stages = profile.report()['stages']
+    for name in ('background', 'foreground'):
+        assert stages[name]['overlapped_calls'] == 1
+        assert 'peak_bytes' not in stages[name]
+    assert 'overlapped_calls' not in stages['alone']
+    assert stages['alone']['peak_bytes'] >= len(data)
+
+def test_prefetcher_times_parse_in_producer():
+    profile = StageProfile()
+
+    def slow_chunks():
+        for _ in range(3):
+            time.sleep(0.05)
+            yield pd.DataFrame({'x': range(10)})
+
+    chunks = ChunkPrefetcher(slow_chunks(), profile=profile)
+    time.sleep(0.3)
+    rows = sum(len(chunk) for chunk in profile.iterate('parse_wait', chunks))
+
+    stages = profile.report()['stages']
+    assert rows == 30 and stages['parse']['rows'] == 30
+    assert stages['parse']['seconds'] >= 0.15
+    assert stages['parse_wait']['seconds'] < stages['parse']['seconds']